@@ -0,0 +1,428 @@
+"""Analytics of the pruned co-occurrence graph on integer arrays, without networkx.
+
+The graph is kept in CSR form: the neighbors of the i'th node are neighbors[indptr[i]:indptr[i + 1]],
+both directions of each edge are stored. On top of it:
+
+    components: connected components with a vectorized union-find (hooking and pointer jumping)
+    degree_stats: degree and weighted degree statistics
+    k_core: the subgraph in which every node has at least k neighbors
+    label_propagation, louvain: community detection
+
+Both community methods keep the communities inside the connected components and give the same
+result for a component whether it is processed alone or together with others, so
+detect_communities shards the components among worker processes. Louvain moves the nodes in
+rounds: each node moves to the neighboring community with the best modularity gain at the same time.
+If that does not improve the modularity of a component, the round is undone and repeated carefully:
+only the nodes without a better neighbor that moves, and one node into and out of each community,
+which always improves it.
+
+The communities are written as {input}-communities.csv (one line per community, its terms by
+decreasing weighted degree) and {input}-nodes.csv (the community, component, degree and weighted
+degree of each term). Run it with process.py --communities, or on a binary edge list:
+
+    python zargan/analytics.py zargan/data/filtered.txt.zedges --method louvain --k-core 2 --workers 4
+"""
+import logging
+import argparse
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from histogram import reduce_keys
+from export import graph_arrays, read_edges
+
+logger = logging.getLogger("ZarganApp")
+
+# Smallest modularity gain of a move.
+EPSILON = 1e-12
+
+
+class CSRGraph(object):
+    def __init__(self, nodes, sources, targets, weights):
+        """Undirected graph of the edges sources[i] - targets[i].
+        @param nodes: ids of the nodes, e.g. the query ids; sources and targets are positions in nodes.
+        """
+        self.nodes = np.asarray(nodes, dtype=np.int64)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.int64)
+        rows = np.concatenate((sources, targets))
+        columns = np.concatenate((targets, sources))
+        order = np.lexsort((columns, rows))
+        self.indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.nodes)), out=self.indptr[1:])
+        self.neighbors = columns[order]
+        self.weights = np.concatenate((weights, weights))[order]
+
+    @classmethod
+    def from_histogram(cls, hist):
+        """Graph of the edges of the histogram; the nodes are the query ids."""
+        return cls(*graph_arrays(hist))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def edge_count(self):
+        return len(self.neighbors) // 2
+
+    def rows(self):
+        """Position of the node of each entry of neighbors."""
+        return np.repeat(np.arange(len(self.nodes)), np.diff(self.indptr))
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    def weighted_degrees(self):
+        return np.bincount(self.rows(), self.weights, minlength=len(self.nodes)).astype(np.int64)
+
+    def edges(self):
+        """@return: (sources, targets, weights) of each edge once, where sources < targets."""
+        rows = self.rows()
+        once = rows < self.neighbors
+        return rows[once], self.neighbors[once], self.weights[once]
+
+    def subgraph(self, mask):
+        """Returns the graph of the nodes for which mask is True, in the same order."""
+        positions = np.cumsum(mask) - 1
+        sources, targets, weights = self.edges()
+        kept = mask[sources] & mask[targets]
+        return CSRGraph(self.nodes[mask], positions[sources[kept]], positions[targets[kept]], weights[kept])
+
+
+def components(graph):
+    """Connected components with a vectorized union-find.
+    @return: component of each node, numbered in the order of their first nodes.
+    """
+    sources, targets, _ = graph.edges()
+    parent = np.arange(len(graph))
+    while True:
+        # Both ends are roots after the pointer jumping, the larger root is hooked under the smaller.
+        roots, other = parent[sources], parent[targets]
+        low, high = np.minimum(roots, other), np.maximum(roots, other)
+        differ = low != high
+        if not differ.any():
+            break
+        np.minimum.at(parent, high[differ], low[differ])
+        while True:
+            grand = parent[parent]
+            if (grand == parent).all():
+                break
+            parent = grand
+    return np.unique(parent, return_inverse=True)[1]
+
+
+def degree_stats(graph):
+    """@return: dict of the number of nodes, edges and components and the degree statistics."""
+    stats = {"nodes": len(graph), "edges": graph.edge_count(),
+             "components": int(components(graph).max()) + 1 if len(graph) else 0}
+    for name, values in (("degree", graph.degrees()), ("weighted_degree", graph.weighted_degrees())):
+        if not len(values):
+            continue
+        stats["min_" + name] = int(values.min())
+        stats["max_" + name] = int(values.max())
+        stats["mean_" + name] = float(values.mean())
+        stats["median_" + name] = float(np.median(values))
+        stats["p99_" + name] = float(np.percentile(values, 99))
+    return stats
+
+
+def k_core(graph, k):
+    """Returns the k-core: the largest subgraph in which every node has at least k neighbors."""
+    sources, targets, _ = graph.edges()
+    alive = np.ones(len(graph), dtype=bool)
+    while True:
+        kept = alive[sources] & alive[targets]
+        degrees = np.bincount(sources[kept], minlength=len(graph)) + \
+            np.bincount(targets[kept], minlength=len(graph))
+        removed = alive & (degrees < k)
+        if not removed.any():
+            return graph.subgraph(alive)
+        alive &= ~removed
+
+
+def best_per_node(nodes, candidates, scores, preferred=None):
+    """Returns the positions of the highest score of each node; ties go to the preferred candidates
+    (a mask) and then to the smallest candidate. The entries must be sorted by node and candidate,
+    like the keys of reduce_keys.
+    """
+    if not len(nodes):
+        return np.zeros(0, dtype=np.int64)
+    firsts = np.concatenate(([True], nodes[1:] != nodes[:-1]))
+    starts = np.flatnonzero(firsts)
+    groups = np.cumsum(firsts) - 1
+    best = scores == np.maximum.reduceat(scores, starts)[groups]
+    if preferred is not None:
+        # 2 for the preferred best entries, 1 for the other best entries.
+        best = best * 1 + (best & preferred)
+        best = best == np.maximum.reduceat(best, starts)[groups]
+    positions = np.flatnonzero(best)
+    return positions[np.concatenate(([True], groups[positions][1:] != groups[positions][:-1]))]
+
+
+def label_propagation(graph, max_iterations=20):
+    """Semi-synchronous label propagation: each node takes the label with the largest weight among its
+    neighbors, the nodes with even and odd ids taking turns so the labels do not oscillate. A node keeps
+    its label if it is one of the heaviest.
+    @return: community of each node, a node position in the same component.
+    """
+    rows = graph.rows()
+    labels = np.arange(len(graph))
+    parity = graph.nodes & 1
+    unchanged = 0
+    for iteration in xrange(max_iterations):
+        keys, weights = reduce_keys((rows << 32) | labels[graph.neighbors], graph.weights)
+        nodes, candidates = keys >> 32, keys & 0xffffffff
+        best = best_per_node(nodes, candidates, weights, candidates == labels[nodes])
+        update = nodes[best][parity[nodes[best]] == iteration % 2]
+        new_labels = labels.copy()
+        new_labels[update] = candidates[best][parity[nodes[best]] == iteration % 2]
+        unchanged = unchanged + 1 if (new_labels == labels).all() else 0
+        labels = new_labels
+        if unchanged == 2:
+            break
+    return labels
+
+
+def component_modularity(sources, targets, weights, strengths, communities, component, scale):
+    """Modularity of each component with the given communities; communities are node positions."""
+    internal = np.bincount(communities[sources], weights * (communities[sources] == communities[targets]),
+                           minlength=len(communities))
+    totals = np.bincount(communities, strengths, minlength=len(communities))
+    scores = internal * scale[component] - (totals * scale[component]) ** 2
+    return np.bincount(component, scores, minlength=len(scale))
+
+
+def move_nodes(sources, targets, weights, component, scale, max_iterations, tolerance):
+    """Local moving phase of louvain on a graph given as directed entries (self loops once).
+    @param component: component of each node.
+    @param scale: 1 / (2 * total edge weight) of each component.
+    @param tolerance: a component stops after a round that improves its modularity less than this.
+    @return: community of each node, a node position.
+    """
+    count = len(component)
+    strengths = np.bincount(sources, weights, minlength=count)
+    communities = np.arange(count)
+    totals = strengths.copy()
+    # Components in which the moves of the last round did not improve the modularity move carefully.
+    careful = np.zeros(len(scale), dtype=bool)
+    active = np.ones(len(scale), dtype=bool)
+    modularity = component_modularity(sources, targets, weights, strengths, communities, component, scale)
+    links = sources != targets
+    link_sources, link_targets, link_weights = sources[links], targets[links], weights[links]
+    for _ in xrange(max_iterations):
+        keys, to_community = reduce_keys((link_sources << 32) | communities[link_targets], link_weights)
+        nodes, candidates = keys >> 32, keys & 0xffffffff
+        own = candidates == communities[nodes]
+        to_own = np.zeros(count)
+        to_own[nodes[own]] = to_community[own]
+        gains = (to_community - to_own[nodes] - strengths[nodes] * scale[component[nodes]] *
+                 (totals[candidates] - totals[communities[nodes]] + strengths[nodes]))
+        valid = ~own & (gains > EPSILON) & active[component[nodes]]
+        best = best_per_node(nodes[valid], candidates[valid], gains[valid])
+        movers, targets_of = nodes[valid][best], candidates[valid][best]
+        if not len(movers):
+            break
+        gain = np.zeros(count)
+        gain[movers] = gains[valid][best]
+
+        # Two single node communities do not swap: only the one with the larger label moves.
+        sizes = np.bincount(communities, minlength=count)
+        chosen = (sizes[communities[movers]] > 1) | (sizes[targets_of] > 1) | (targets_of < communities[movers])
+        if careful.any():
+            # A node does not move if a neighbor with a larger gain (or the same gain and a smaller
+            # position) moves, and one node leaves and one node joins each community.
+            strict = careful[component[movers]]
+            first, second = link_sources, link_targets
+            both = (gain[first] > 0) & (gain[second] > 0)
+            blocked = both & ((gain[second] > gain[first]) | ((gain[second] == gain[first]) & (second < first)))
+            stay = np.zeros(count, dtype=bool)
+            stay[first[blocked]] = True
+            chosen &= ~(stay[movers] & strict)
+            for groups in (communities[movers], targets_of):
+                ranked = np.lexsort((movers, -gain[movers], groups))
+                winners = np.zeros(len(movers), dtype=bool)
+                winners[ranked[np.concatenate(([True], groups[ranked][1:] != groups[ranked][:-1]))]] = True
+                chosen &= winners | ~strict
+        movers, targets_of = movers[chosen], targets_of[chosen]
+
+        new_communities = communities.copy()
+        new_communities[movers] = targets_of
+        new_modularity = component_modularity(sources, targets, weights, strengths, new_communities, component,
+                                              scale)
+        improved = new_modularity > modularity + EPSILON
+        new_communities[~improved[component]] = communities[~improved[component]]
+        active &= (improved & (new_modularity > modularity + tolerance)) | (~improved & ~careful)
+        careful = ~improved
+        modularity = np.where(improved, new_modularity, modularity)
+        communities = new_communities
+        totals = np.bincount(communities, strengths, minlength=count)
+    return communities
+
+
+def louvain(graph, max_levels=10, max_iterations=40, tolerance=1e-6):
+    """Louvain community detection: the nodes are moved between the communities while the modularity
+    of their component improves, at most max_iterations rounds, then the communities become the nodes
+    of the next level.
+    @return: community of each node, a node position in the same component.
+    """
+    if not len(graph):
+        return np.zeros(0, dtype=np.int64)
+    sources = graph.rows()
+    targets, weights = graph.neighbors, graph.weights.astype(np.float64)
+    component = components(graph)
+    # Components without edges have no weight.
+    scale = 1.0 / np.maximum(np.bincount(component[sources], weights, minlength=component.max() + 1), EPSILON)
+    # Community of each node of the graph as a node of the current level.
+    labels = np.arange(len(graph))
+    members = np.arange(len(graph))
+    for _ in xrange(max_levels):
+        communities = move_nodes(sources, targets, weights, component, scale, max_iterations, tolerance)
+        if (communities == np.arange(len(communities))).all():
+            break
+        unique, communities = np.unique(communities, return_inverse=True)
+        labels = communities[labels]
+        # Each community is represented by the node it is labelled with.
+        members = members[unique]
+        component = component[unique]
+        keys, weights = reduce_keys((communities[sources] << 32) | communities[targets], weights)
+        sources, targets = keys >> 32, keys & 0xffffffff
+    return members[labels]
+
+
+METHODS = {
+    "louvain": louvain,
+    "labels": label_propagation,
+}
+
+
+def detect_shard(args):
+    """Worker of detect_communities.
+    @param args: (method, nodes, sources, targets, weights) of the graph of the shard.
+    """
+    method, nodes, sources, targets, weights = args
+    return METHODS[method](CSRGraph(nodes, sources, targets, weights))
+
+
+def detect_communities(graph, method="louvain", workers=1):
+    """Finds the communities with one of METHODS. The components are sharded among the worker
+    processes by their number of edges.
+    @return: community of each node, numbered in the order of their first nodes.
+    """
+    if workers <= 1 or not len(graph):
+        return np.unique(METHODS[method](graph), return_inverse=True)[1]
+    component = components(graph)
+    sizes = np.bincount(component[graph.rows()], minlength=component.max() + 1)
+    # The largest components first, each to the least loaded worker.
+    loads = [0] * workers
+    shard_of = np.zeros(len(sizes), dtype=np.int64)
+    for c in np.argsort(-sizes, kind="mergesort").tolist():
+        shard = loads.index(min(loads))
+        shard_of[c] = shard
+        loads[shard] += int(sizes[c]) + 1
+    masks = [shard_of[component] == w for w in xrange(workers)]
+    shards = []
+    for mask in masks:
+        sub = graph.subgraph(mask)
+        shards.append((method, sub.nodes) + sub.edges())
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(detect_shard, shards)
+    finally:
+        pool.terminate()
+    labels = np.zeros(len(graph), dtype=np.int64)
+    for mask, result in itertools.izip(masks, results):
+        positions = np.flatnonzero(mask)
+        labels[positions] = positions[result]
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def modularity(graph, labels):
+    """Modularity of the communities on the whole graph."""
+    rows = graph.rows()
+    weights = graph.weights.astype(np.float64)
+    total = weights.sum()
+    if not total:
+        return 0.0
+    internal = weights[labels[rows] == labels[graph.neighbors]].sum()
+    totals = np.bincount(labels, graph.weighted_degrees().astype(np.float64))
+    return float(internal / total - ((totals / total) ** 2).sum())
+
+
+def write_communities(graph, labels, terms, filename):
+    """Writes one line per community, the largest first: its number, size, internal weight and its
+    utf-8 encoded terms by decreasing weighted degree.
+    """
+    rows = graph.rows()
+    strengths = graph.weighted_degrees()
+    sizes = np.bincount(labels)
+    same = labels[rows] == labels[graph.neighbors]
+    internal = np.bincount(labels[rows[same]], graph.weights[same], minlength=len(sizes)).astype(np.int64) // 2
+    order = np.lexsort((np.arange(len(graph)), -strengths, labels))
+    bounds = np.concatenate(([0], np.cumsum(sizes))).tolist()
+    o = open(filename, "w")
+    o.write("community; size; weight; terms\n")
+    for community in np.lexsort((np.arange(len(sizes)), -sizes)).tolist():
+        members = order[bounds[community]:bounds[community + 1]].tolist()
+        o.write("{0}; {1}; {2}; {3}\n".format(community, sizes[community], internal[community],
+                                                ", ".join(terms[i] for i in members)))
+    o.close()
+    logger.info("Wrote {0} communities: {1}".format(len(sizes), filename))
+
+
+def write_nodes(graph, labels, terms, filename):
+    """Writes the community, component, degree and weighted degree of each term."""
+    o = open(filename, "w")
+    o.write("term; community; component; degree; weighted degree\n")
+    for row in itertools.izip(terms, labels.tolist(), components(graph).tolist(), graph.degrees().tolist(),
+                              graph.weighted_degrees().tolist()):
+        o.write("{0}; {1}; {2}; {3}; {4}\n".format(*row))
+    o.close()
+    logger.info("Wrote the communities of {0} terms: {1}".format(len(terms), filename))
+
+
+def analyze(graph, terms, base, method="louvain", k=None, workers=1):
+    """Logs the statistics of the graph, finds its communities and writes them to {base}-communities.csv
+    and {base}-nodes.csv.
+    @param terms: utf-8 encoded terms of the nodes.
+    @param k: analyze only the k-core of the graph if given.
+    @return: (statistics, community of each node of the analyzed graph)
+    """
+    if k:
+        core = k_core(graph, k)
+        positions = np.searchsorted(graph.nodes, core.nodes)
+        terms = [terms[i] for i in positions.tolist()]
+        logger.info("The {0}-core has {1} of the {2} nodes.".format(k, len(core), len(graph)))
+        graph = core
+    stats = degree_stats(graph)
+    for name, value in sorted(stats.iteritems()):
+        logger.info("{0}: {1}".format(name, value))
+    labels = detect_communities(graph, method, workers)
+    stats["communities"] = int(labels.max()) + 1 if len(labels) else 0
+    stats["modularity"] = modularity(graph, labels)
+    logger.info("{0} communities, modularity {1:.4f}".format(stats["communities"], stats["modularity"]))
+    write_communities(graph, labels, terms, "{0}-communities.csv".format(base))
+    write_nodes(graph, labels, terms, "{0}-nodes.csv".format(base))
+    return stats, labels
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Finds the communities of a binary edge list.")
+    parser.add_argument("edges", help="edge list written with process.py --graph-format edges")
+    parser.add_argument("--method", choices=sorted(METHODS), default="louvain",
+                        help="Louvain modularity optimization or label propagation")
+    parser.add_argument("--k-core", type=int, default=None, help="analyze only the k-core of the graph")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes the connected components are shared among")
+    options = parser.parse_args(args)
+
+    terms, edges = read_edges(options.edges)
+    graph = CSRGraph(np.arange(len(terms)), edges["source"], edges["target"], edges["weight"])
+    base = ".".join(options.edges.split(".")[:-1])
+    analyze(graph, [term.encode("utf-8") for term in terms], base, options.method, options.k_core,
+            options.workers)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
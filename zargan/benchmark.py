@@ -0,0 +1,176 @@
+"""Benchmarks of clear.py and the stages of ZarganApp on synthetic logs of several sizes.
+
+For each scale, a raw stats file is generated with generate.py and cleaned with clear.main; then
+the stages of ZarganApp.run are timed on the cleaned file one by one. Each scale runs in a fresh
+process, so the peak memory of a scale does not include the previous ones. The filters of clear.py
+are also timed separately on all of the lines.
+
+Every run appends one JSON document to the results file (benchmarks.jsonl by default), with the
+commit, the versions and the options of the run, so runs can be compared over time:
+
+    python zargan/benchmark.py --scales 10000,100000,1000000
+"""
+import os
+import time
+import json
+import codecs
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+import numpy as np
+
+import clear
+import generate
+from metrics import rss, peak_rss
+from process import ZarganApp
+
+logger = logging.getLogger("ZarganApp")
+
+
+def measure(results, component, stage, scale, function, *args):
+    """Runs function(*args) and appends its duration and the memory after it to results."""
+    start = time.time()
+    value = function(*args)
+    results.append({
+        "component": component,
+        "stage": stage,
+        "scale": scale,
+        "seconds": round(time.time() - start, 6),
+        "rss_mb": rss(),
+        "peak_mb": peak_rss(),
+    })
+    logger.info("{0}.{1} ({2}): {3:.3f} s".format(component, stage, scale, results[-1]["seconds"]))
+    return value
+
+
+def time_filters(results, scale, filename):
+    """Times each filter of clear.py on all of the complete lines of filename."""
+    lines = codecs.open(filename, encoding="iso-8859-1").read().splitlines()[1:]
+    rows = [cols for cols in (line.split("|") for line in lines) if len(cols) == 12]
+    # A new engine, so the caches are not warmed up by clear.main.
+    engine = clear.FilterEngine.load()
+    for name in ("filter_ip", "filter_corporation", "filter_campaign", "filter_dictionary"):
+        function = getattr(engine, name)
+        if name == "filter_dictionary":
+            rejected = measure(results, "clear", name, scale, lambda: sum(1 for cols in rows if function(cols[0])))
+        else:
+            rejected = measure(results, "clear", name, scale, lambda: sum(1 for cols in rows if function(cols)))
+        results[-1]["rejected"] = rejected
+
+
+def run_scale(directory, scale, options):
+    """Generates and benchmarks one scale in the directory.
+    The results of the stages are written to results-{scale}.json in the directory.
+    """
+    os.chdir(directory)
+    stats = "stats-{0}.txt".format(scale)
+    filtered = "filtered-{0}.txt".format(scale)
+    generate.generate(stats, searches=scale, ips=max(100, scale / 20), vocabulary=max(1000, scale / 10),
+                      seed=options["seed"], dictionaries=os.path.join("zargan", "data"))
+
+    results = []
+    # clear.py reads its dictionaries from zargan/data in the working directory.
+    clear.engine = None
+    measure(results, "clear", "load_dictionaries", scale, clear.load_dictionaries)
+    measure(results, "clear", "main", scale, clear.main, stats, filtered, options["clear_workers"])
+    results[-1]["rejected"] = dict(clear.engine.rejected)
+    clear.engine.rejected.clear()
+    time_filters(results, scale, stats)
+
+    app = ZarganApp(filtered, scale, options["window_size"], options["prune_threshold"], generate_graph=False,
+                    complete_chain=options["complete_chain"], workers=options["workers"],
+                    histogram=options["histogram"])
+    for stage in ("read_input", "generate_hashmap", "check_fraud", "write_hashmap", "generate_histogram",
+                  "prune_histogram", "write_text", "generate_graph", "export_graph"):
+        measure(results, "process", stage, scale, getattr(app, stage))
+    results[-1]["edges"] = len(app.occurrence_histogram)
+    json.dump(results, open("results-{0}.json".format(scale), "w"))
+
+
+def git_commit():
+    """Commit of the working tree, or None if it is not a git repository."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(scales, options, results_file="benchmarks.jsonl", work_dir=None):
+    """Runs the benchmarks of the scales and appends the run to results_file.
+    @param options: dict of seed, clear_workers, window_size, prune_threshold, complete_chain, workers and histogram.
+    @param work_dir: directory for the generated files. A temporary one which is deleted at the end if None.
+    """
+    directory = work_dir or tempfile.mkdtemp(prefix="zargan-benchmark-")
+    results_file = os.path.abspath(results_file)
+    run = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": multiprocessing.cpu_count(),
+        "options": options,
+        "results": [],
+    }
+    try:
+        for scale in scales:
+            # A new process for each scale, so the peak memory is of that scale only. It is not a pool
+            # worker, because the stages may start their own worker processes.
+            process = multiprocessing.Process(target=run_scale, args=(directory, scale, options))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError("The benchmark of scale {0} failed.".format(scale))
+            run["results"].extend(json.load(open(os.path.join(directory, "results-{0}.json".format(scale)))))
+    finally:
+        if work_dir is None:
+            shutil.rmtree(directory)
+
+    f = open(results_file, "a")
+    f.write(json.dumps(run, sort_keys=True) + "\n")
+    f.close()
+    logger.info("Appended the results to {0}".format(results_file))
+    return run
+
+
+def print_table(run):
+    print "{0:<8} {1:<22} {2:>10} {3:>10} {4:>10} {5:>10}".format("", "stage", "scale", "seconds", "rss MB",
+                                                                  "peak MB")
+    for result in run["results"]:
+        print "{0:<8} {1:<22} {2:>10} {3:>10.3f} {4:>10} {5:>10}".format(
+            result["component"], result["stage"], result["scale"], result["seconds"],
+            "-" if result["rss_mb"] is None else "{0:.1f}".format(result["rss_mb"]),
+            "-" if result["peak_mb"] is None else "{0:.1f}".format(result["peak_mb"]))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Benchmarks clear.py and ZarganApp on synthetic logs.")
+    parser.add_argument("--scales", type=lambda x: map(int, x.split(",")), default=[10000, 100000],
+                        help="comma separated numbers of searches, e.g. 10000,100000,1000000")
+    parser.add_argument("--results", default="benchmarks.jsonl", help="file the results are appended to")
+    parser.add_argument("--work-dir", default=None, help="keep the generated files in this directory")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--clear-workers", type=int, default=1)
+    parser.add_argument("--window-size", type=float, default=300.0)
+    parser.add_argument("--prune-threshold", type=int, default=20)
+    parser.add_argument("--complete-chain", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--histogram", default="packed")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    options = vars(parse_args())
+    scales = options.pop("scales")
+    results_file = options.pop("results")
+    work_dir = options.pop("work_dir")
+    if work_dir and not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    print_table(benchmark(scales, options, results_file, work_dir and os.path.abspath(work_dir)))
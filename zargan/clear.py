@@ -1,89 +1,311 @@
 # encoding: utf-8
+import os
 import codecs
-import sys
-from nltk.stem import WordNetLemmatizer
+import bisect
+import argparse
+import itertools
+import collections
+import multiprocessing
+
+import inputs
+
 
 def char_fix(line):
-    try:
+    """Fixes the Turkish characters of the line and returns it utf-8 encoded.
+    The replacements run on the encoded bytes: unicode.translate looks up every character in a dict,
+    which is several times slower than a few str.replace calls.
+    """
+    if isinstance(line, unicode):
         line = line.encode("utf-8")
-    except:
-        pass
-    return line.replace('ý', 'ı').replace('ý', 'ı').replace('þ', 'ş').replace('ð', 'ğ').replace("\r", "").replace('Ý', 'İ').strip()
+    return line.replace("ý", "ı").replace("þ", "ş").replace("ð", "ğ").replace("\r", "").replace("Ý", "İ").strip()
 
-en_content = char_fix(codecs.open("zargan/data/en_dict.txt", encoding="ascii").read())
-tr_content = char_fix(codecs.open("zargan/data/tr_dict.txt", encoding="utf-8").read())
+# Queries of the campaign searches which are not valuable.
+CAMPAIGN_TERMS = frozenset([u"unfamşiar", u"kanıtlamk", u"toplam değişken", u"çalışmak zorunda kalmak",
+                            u"conservative", u"conservation", u"conservativative", u"irregular", u"unfair",
+                            u"kani"])
 
-en_dictionary = set(en_content.split("\n"))
-tr_dictionary = set(tr_content.split("\n"))
+# Approximate size of the chunks processed by the workers in bytes.
+CHUNK_SIZE = 16 * 1024 * 1024
 
-blocked_ips = open("zargan/data/blocked_ips.txt").read().split("\n")
+# Number of IPs whose filter_ip result is kept. A few IPs send most of the searches.
+CACHE_SIZE = 1 << 16
+
+# Names of the filters in the order they are applied.
+FILTERS = ("corrupted", "ip", "corporation", "campaign", "dictionary")
+
+engine = None
+
+
+def ip_to_int(ip):
+    """Returns the dotted IPv4 address as an integer, or None if it is not a valid address."""
+    try:
+        parts = map(int, ip.split("."))
+    except ValueError:
+        return None
+    if len(parts) != 4 or not all(0 <= part <= 255 for part in parts):
+        return None
+    return (parts[0] << 24) | (parts[1] << 16) | (parts[2] << 8) | parts[3]
 
-def filter_campaign(cols):
-    """
-    Returns True if the search is a campaign search and not valuable.
-    """
-    words = [u"unfamşiar", u"kanıtlamk", u"toplam değişken", u"çalışmak zorunda kalmak", u"conservative", \
-             u"conservation", u"conservativative", u"irregular", u"unfair", u"kani"]
 
-    if cols[0].lower() in words:
-        return True
+class IPBlocklist(object):
+    def __init__(self, lines):
+        """Blocked addresses and CIDR ranges (a.b.c.d/n), one per line.
+        Addresses are kept as integers in a set; the ranges are merged and searched with bisect.
+        """
+        self.addresses = set()
+        ranges = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            address, _, prefix = line.partition("/")
+            start = ip_to_int(address)
+            if start is None:
+                raise ValueError("Invalid blocked IP: {0!r}".format(line))
+            if not prefix or int(prefix) == 32:
+                self.addresses.add(start)
+                continue
+            size = 1 << (32 - int(prefix))
+            start &= ~(size - 1)
+            ranges.append((start, start + size - 1))
 
-def filter_dictionary(cols):
-    tokens = char_fix(cols[0]).lower().split()
-    for token in tokens:
-        if (token not in en_dictionary) and (token not in tr_dictionary):
-            #print token
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(ranges):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __contains__(self, ip):
+        """@param ip: address as an integer."""
+        if ip is None:
+            return False
+        if ip in self.addresses:
             return True
+        i = bisect.bisect_right(self.starts, ip) - 1
+        return i >= 0 and ip <= self.ends[i]
 
 
-def filter_corporation(cols):
-    """
-    Returns True if the search has corporate id. We won't use corporate search logs.
-    """
-    return cols[5]
+class FilterEngine(object):
+    def __init__(self, en_dictionary, tr_dictionary, blocked_ips):
+        """Filters of the lines of a stats file.
+        rejected counts the lines dropped by each filter, see FILTERS.
+        """
+        self.en_dictionary = en_dictionary
+        self.tr_dictionary = tr_dictionary
+        self.blocked_ips = blocked_ips
+        # ip -> filter_ip result, cleared when it has CACHE_SIZE addresses.
+        self.ip_cache = {}
+        self.rejected = collections.Counter()
 
-def filter_ip(cols):
+    @classmethod
+    def load(cls, path="zargan/data", blocklists=()):
+        """Loads the dictionaries and blocked_ips.txt from path.
+        @param blocklists: more files of blocked IPs, e.g. written by process.py --blocklist.
+        """
+        en_content = char_fix(codecs.open(os.path.join(path, "en_dict.txt"), encoding="ascii").read())
+        tr_content = char_fix(codecs.open(os.path.join(path, "tr_dict.txt"), encoding="utf-8").read())
+        blocked_ips = IPBlocklist(itertools.chain.from_iterable(
+            open(filename) for filename in [os.path.join(path, "blocked_ips.txt")] + list(blocklists)))
+        return cls(frozenset(en_content.split("\n")), frozenset(tr_content.split("\n")), blocked_ips)
 
-    ip = ".".join(map(str, map(int, cols[1].split("."))))
-    if ip in blocked_ips:
-        return True
+    def filter_ip(self, cols):
+        try:
+            return self.ip_cache[cols[1]]
+        except KeyError:
+            if len(self.ip_cache) >= CACHE_SIZE:
+                self.ip_cache.clear()
+            blocked = self.ip_cache[cols[1]] = ip_to_int(cols[1]) in self.blocked_ips
+            return blocked
 
+    def filter_corporation(self, cols):
+        """
+        Returns True if the search has corporate id. We won't use corporate search logs.
+        """
+        return cols[5]
 
+    def filter_campaign(self, cols):
+        """
+        Returns True if the search is a campaign search and not valuable.
+        """
+        return cols[0].lower() in CAMPAIGN_TERMS
 
-def main(in_file="zargan/data/stats20080113-02.txt", out_file="zargan/data/filtered.txt"):
-    f = codecs.open(in_file, encoding="iso-8859-1")
-    o = open(out_file, "w")
-    eliminated = open("zargan/data/eliminated.txt", "w")
-    o.write(f.readline())
-    wnl = WordNetLemmatizer()
+    def filter_dictionary(self, query):
+        """Returns True if a word of the query is in neither of the dictionaries."""
+        for token in char_fix(query).lower().split():
+            if (token not in self.en_dictionary) and (token not in self.tr_dictionary):
+                return True
+        return False
 
-    for line in f:
+    def clean_line(self, line):
+        """Applies the filters to a line of the input file.
+        @return: (filtered line, eliminated word); both are None if the line is dropped silently.
+        """
         cols = line.split("|")
 
         if len(cols) != 12:
-            continue
-        if filter_ip(cols):
-            continue
-        if filter_corporation(cols):
-            continue
-        if filter_campaign(cols):
-            continue
+            self.rejected["corrupted"] += 1
+            return None, None
+        if self.filter_ip(cols):
+            self.rejected["ip"] += 1
+            return None, None
+        if self.filter_corporation(cols):
+            self.rejected["corporation"] += 1
+            return None, None
+        if self.filter_campaign(cols):
+            self.rejected["campaign"] += 1
+            return None, None
 
         word = cols[0]
-        ip = cols[1]
-
-        if filter_dictionary(cols):
-            eliminated.write("%s\n" % char_fix(word).lower())
-            continue
-        if cols[8] == 2:
-            cols[0] = wnl.lemmatize(cols[0])
-        o.write("%s\n" % char_fix("|".join(cols).encode("utf8")))
+
+        if self.filter_dictionary(word):
+            self.rejected["dictionary"] += 1
+            return None, "%s\n" % char_fix(word).lower()
+        return "%s\n" % char_fix(u"|".join(cols)), None
+
+    def report(self):
+        """Returns the number of lines rejected by each filter as a string."""
+        return "Rejected lines: " + ", ".join("{0}: {1}".format(name, self.rejected[name]) for name in FILTERS)
+
+
+def load_dictionaries(blocklists=()):
+    """Loads the dictionaries and the blocked IPs once per process."""
+    global engine
+    if engine is None:
+        engine = FilterEngine.load(blocklists=blocklists)
+
+
+def clean_line(line):
+    return engine.clean_line(line)
+
+
+def clean_chunk(args):
+    """Cleans the lines in the byte range [start, end) of the input file.
+    @return: (filtered lines, eliminated words) as strings and the rejection counts of the chunk.
+    """
+    in_file, start, end = args
+    f = open(in_file, "rb")
+    f.seek(start)
+    data = f.read(end - start)
+    f.close()
+    # Split the lines like the reader of the serial mode does.
+    return clean_lines(data.decode("iso-8859-1").splitlines(True))
+
+
+def clean_lines(lines):
+    """Cleans the decoded lines, see clean_chunk."""
+    engine.rejected = collections.Counter()
+    filtered = []
+    eliminated = []
+    for line in lines:
+        output, word = clean_line(line)
+        if output is not None:
+            filtered.append(output)
+        elif word is not None:
+            eliminated.append(word)
+    return "".join(filtered), "".join(eliminated), engine.rejected
+
+
+def chunk_ranges(in_file, start, chunk_size=CHUNK_SIZE):
+    """Splits the file after the start offset into byte ranges ending at line boundaries."""
+    size = os.path.getsize(in_file)
+    f = open(in_file, "rb")
+    ranges = []
+    while start < size:
+        f.seek(min(start + chunk_size, size))
+        # Move the end to the start of the next line.
+        f.readline()
+        end = min(f.tell(), size)
+        ranges.append((in_file, start, end))
+        start = end
+    f.close()
+    return ranges
+
+
+def line_batches(lines, chunk_size=CHUNK_SIZE):
+    """Splits the lines into lists of about chunk_size characters."""
+    batch = []
+    size = 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def clean_batches(pool, batches, pending):
+    """Cleans the batches of lines in the pool and yields the results in order.
+    At most pending batches are sent ahead, so the input is not read into memory faster than it is cleaned.
+    """
+    results = collections.deque()
+    for batch in batches:
+        results.append(pool.apply_async(clean_lines, (batch,)))
+        if len(results) >= pending:
+            yield results.popleft().get()
+    while results:
+        yield results.popleft().get()
+
+
+def main(in_file="zargan/data/stats20080113-02.txt", out_file="zargan/data/filtered.txt", workers=1,
+         chunk_size=CHUNK_SIZE, blocklists=()):
+    """Cleans in_file into out_file and writes the words that are not in the dictionaries to eliminated.txt.
+    @param in_file: input file, glob pattern or list of them; the files may be compressed, see inputs.py.
+    The header of the first file is written to out_file.
+    @param workers: number of processes. The file is split into chunks of chunk_size bytes which are
+    cleaned in parallel and written in the original order.
+    @param blocklists: files of blocked IPs besides zargan/data/blocked_ips.txt.
+    """
+    load_dictionaries(blocklists)
+    o = open(out_file, "w")
+    eliminated = open("zargan/data/eliminated.txt", "w")
+    o.write(inputs.read_header(in_file, "iso-8859-1"))
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=load_dictionaries, initargs=(blocklists,))
+        if inputs.is_plain_file(in_file):
+            # The header is the first line; its length in bytes is the start of the data.
+            in_file = inputs.expand(in_file)[0]
+            header = open(in_file, "rb").readline()
+            chunks = pool.imap(clean_chunk, chunk_ranges(in_file, len(header), chunk_size))
+        else:
+            # Compressed and multiple files can not be split by offsets; their lines are sent in batches.
+            chunks = clean_batches(pool, line_batches(inputs.read_lines(in_file, "iso-8859-1"), chunk_size),
+                                   2 * workers)
+        try:
+            for filtered, words, rejected in chunks:
+                o.write(filtered)
+                eliminated.write(words)
+                engine.rejected.update(rejected)
+        finally:
+            pool.terminate()
+    else:
+        for line in inputs.read_lines(in_file, "iso-8859-1"):
+            output, word = clean_line(line)
+            if output is not None:
+                o.write(output)
+            elif word is not None:
+                eliminated.write(word)
     o.close()
     eliminated.close()
+    print engine.report()
 
 
 if __name__ == "__main__":
-    try:
-        main(sys.argv[1], sys.argv[2])
-    except IndexError:
-        main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Removes the corrupted and unwanted lines of a stats file.")
+    parser.add_argument("in_file", nargs="?", default="zargan/data/stats20080113-02.txt",
+                        help="input file or a quoted glob pattern; .gz, .bz2 and .xz files are decompressed")
+    parser.add_argument("out_file", nargs="?", default="zargan/data/filtered.txt")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes cleaning the file in chunks")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE / 1024 / 1024,
+                        help="size of the chunks in MB")
+    parser.add_argument("--blocklist", action="append", default=[],
+                        help="file of blocked IPs besides zargan/data/blocked_ips.txt, e.g. written by "
+                             "process.py --blocklist; may be given more than once")
+    options = parser.parse_args()
+    main(options.in_file, options.out_file, options.workers, options.chunk_size * 1024 * 1024, options.blocklist)
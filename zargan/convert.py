@@ -0,0 +1,37 @@
+"""Converts the output of clear.py into the binary columnar format of RecordStore.
+
+Usage: python zargan/convert.py zargan/data/filtered.txt [zargan/data/filtered.zbin]
+
+The converted directory can be given to process.py instead of the text file. It is memory mapped,
+so the records are not parsed again and item_count only takes a slice of the columns.
+"""
+import sys
+import logging
+
+from records import RecordStore, read_fields
+
+logger = logging.getLogger("ZarganApp")
+logging.basicConfig(level=logging.DEBUG)
+
+
+def convert(in_file, out_dir):
+    logger.info("Converting {0} into {1}...".format(in_file, out_dir))
+    store = RecordStore()
+    for fields in read_fields(in_file):
+        store.append(fields)
+    store.finalize()
+    store.save(out_dir)
+    logger.info("Converted {0} records: {1} queries, {2} IPs.".format(len(store), len(store.queries),
+                                                                      len(store.ips)))
+
+
+if __name__ == "__main__":
+    try:
+        in_file = sys.argv[1]
+    except IndexError:
+        in_file = "zargan/data/filtered.txt"
+    try:
+        out_dir = sys.argv[2]
+    except IndexError:
+        out_dir = "{0}.zbin".format(".".join(in_file.split(".")[:-1]))
+    convert(in_file, out_dir)
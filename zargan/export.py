@@ -0,0 +1,308 @@
+"""Streaming writers of the pruned histogram.
+
+write_csv writes the edges sorted by weight. The sort works on integer arrays, where the terms are
+replaced by their ranks in the sorted order of the terms, and spills sorted runs to disk when the
+edges do not fit in the memory budget. The --top options select the heaviest edges with heaps.
+write_edge_set writes the edge sets of the chain comparison (--compare-chains).
+
+The edges are written straight from the histogram arrays, without building a networkx graph. Node
+ids are the query terms like in nx.write_graphml, so the files load the same in Gephi and
+networkx. The binary edge list (.zedges) is a compact format for the other tools of this package:
+
+    header: "ZEDG", version, number of nodes and number of edges ("<4sIQQ")
+    offsets: int64 array of nodes + 1 offsets into the term data
+    terms: utf-8 encoded node terms, the i'th term is terms[offsets[i]:offsets[i + 1]]
+    edges: (source, target, weight) records of node positions and the edge weight ("<u4, <u4, <i8")
+"""
+import os
+import shutil
+import struct
+import heapq
+import logging
+import tempfile
+import itertools
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from histogram import pack, unpack
+
+logger = logging.getLogger("ZarganApp")
+
+# Number of nodes or edges formatted at once.
+CHUNK_SIZE = 65536
+
+EDGES_MAGIC = "ZEDG"
+EDGES_VERSION = 1
+EDGES_HEADER = struct.Struct("<4sIQQ")
+EDGE_DTYPE = np.dtype([("source", "<u4"), ("target", "<u4"), ("weight", "<i8")])
+
+# Bytes of an edge during the sort: the keys and the permutation.
+SORT_RECORD_SIZE = 32
+RUN_DTYPE = np.dtype([("weight", "<i8"), ("u_rank", "<i8"), ("v_rank", "<i8"), ("edge", "<i8")])
+
+# Characters escaped in the attributes, like ElementTree does.
+ATTRIBUTE_ENTITIES = {'"': "&quot;", "\n": "&#10;"}
+
+
+def graph_arrays(hist):
+    """Returns the nodes of the histogram and its edges as node positions.
+    @return: (nodes, sources, targets, weights) where nodes are the sorted query ids.
+    """
+    u_ids, v_ids, weights = hist.arrays()
+    nodes = np.unique(np.concatenate((u_ids, v_ids)))
+    return nodes, np.searchsorted(nodes, u_ids), np.searchsorted(nodes, v_ids), weights
+
+
+def chunks(*arrays):
+    """Yields the arrays in slices of CHUNK_SIZE as lists."""
+    for start in xrange(0, len(arrays[0]), CHUNK_SIZE):
+        yield [array[start:start + CHUNK_SIZE].tolist() for array in arrays]
+
+
+def xml_labels(index, nodes):
+    """Escaped, utf-8 encoded terms of the nodes for the XML attributes."""
+    return [escape(term, ATTRIBUTE_ENTITIES) for term in index.encoded_terms(nodes)]
+
+
+def write_graphml(f, index, nodes, sources, targets, weights):
+    labels = xml_labels(index, nodes)
+    f.write('<?xml version="1.0" encoding="utf-8"?>'
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+            'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n'
+            '  <key attr.name="weight" attr.type="int" for="edge" id="d0" />\n'
+            '  <graph edgedefault="undirected">\n')
+    for start in xrange(0, len(labels), CHUNK_SIZE):
+        f.write("".join('    <node id="%s" />\n' % label for label in labels[start:start + CHUNK_SIZE]))
+    for chunk_sources, chunk_targets, chunk_weights in chunks(sources, targets, weights):
+        f.write("".join('    <edge source="%s" target="%s">\n      <data key="d0">%d</data>\n    </edge>\n' %
+                        (labels[source], labels[target], weight)
+                        for source, target, weight in zip(chunk_sources, chunk_targets, chunk_weights)))
+    f.write("  </graph>\n</graphml>\n")
+
+
+def write_gexf(f, index, nodes, sources, targets, weights):
+    labels = xml_labels(index, nodes)
+    f.write('<?xml version="1.0" encoding="utf-8"?>'
+            '<gexf version="1.1" xmlns="http://www.gexf.net/1.1draft" '
+            'xmlns:viz="http://www.gexf.net/1.1draft/viz" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:schemaLocation="http://www.w3.org/2001/XMLSchema-instance">\n'
+            '  <graph defaultedgetype="undirected" mode="static">\n'
+            '    <nodes>\n')
+    for start in xrange(0, len(labels), CHUNK_SIZE):
+        f.write("".join('      <node id="%s" label="%s" />\n' % (label, label)
+                        for label in labels[start:start + CHUNK_SIZE]))
+    f.write("    </nodes>\n    <edges>\n")
+    edge_id = 0
+    for chunk_sources, chunk_targets, chunk_weights in chunks(sources, targets, weights):
+        f.write("".join('      <edge id="%d" source="%s" target="%s" weight="%d" />\n' %
+                        (edge_id + i, labels[source], labels[target], weight)
+                        for i, (source, target, weight) in enumerate(zip(chunk_sources, chunk_targets,
+                                                                          chunk_weights))))
+        edge_id += len(chunk_sources)
+    f.write("    </edges>\n  </graph>\n</gexf>\n")
+
+
+def write_edges(f, index, nodes, sources, targets, weights):
+    """Writes the binary edge list, see the module documentation."""
+    f.write(EDGES_HEADER.pack(EDGES_MAGIC, EDGES_VERSION, len(nodes), len(sources)))
+    terms = index.encoded_terms(nodes)
+    offsets = np.zeros(len(terms) + 1, dtype="<i8")
+    np.cumsum([len(term) for term in terms], out=offsets[1:])
+    f.write(offsets.tostring())
+    f.write("".join(terms))
+    for start in xrange(0, len(sources), CHUNK_SIZE):
+        edges = np.empty(len(sources[start:start + CHUNK_SIZE]), dtype=EDGE_DTYPE)
+        edges["source"] = sources[start:start + CHUNK_SIZE]
+        edges["target"] = targets[start:start + CHUNK_SIZE]
+        edges["weight"] = weights[start:start + CHUNK_SIZE]
+        f.write(edges.tostring())
+
+
+def read_edges(filename):
+    """Reads a binary edge list.
+    @return: (terms, edges) where terms are the unicode node terms and edges is a memory mapped
+    record array of EDGE_DTYPE.
+    """
+    f = open(filename, "rb")
+    magic, version, node_count, edge_count = EDGES_HEADER.unpack(f.read(EDGES_HEADER.size))
+    if magic != EDGES_MAGIC or version != EDGES_VERSION:
+        raise ValueError("{0} is not a version {1} edge list.".format(filename, EDGES_VERSION))
+    offsets = np.fromstring(f.read(8 * (node_count + 1)), dtype="<i8")
+    data = f.read(int(offsets[-1]))
+    start = f.tell()
+    f.close()
+    terms = [data[a:b].decode("utf-8") for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    if not edge_count:
+        return terms, np.zeros(0, dtype=EDGE_DTYPE)
+    edges = np.memmap(filename, dtype=EDGE_DTYPE, mode="r", offset=start, shape=(edge_count,))
+    return terms, edges
+
+
+def term_ranks(index, u_ids, v_ids):
+    """Replaces the terms with their positions in the sorted terms, so comparing the ranks is the same
+    as comparing the utf-8 encoded terms.
+    @return: (sorted terms, u_ranks, v_ranks)
+    """
+    nodes = np.unique(np.concatenate((u_ids, v_ids)))
+    terms = index.encoded_terms(nodes)
+    order = sorted(xrange(len(terms)), key=terms.__getitem__)
+    ranks = np.empty(len(terms), dtype=np.int64)
+    ranks[order] = np.arange(len(terms))
+    return ([terms[i] for i in order], ranks[np.searchsorted(nodes, u_ids)],
+            ranks[np.searchsorted(nodes, v_ids)])
+
+
+def top_edges(weights, u_ranks, v_ranks, count, edges=None):
+    """Returns the count heaviest edges, in the output order.
+    @param edges: positions of the edges to choose from. All of the edges if None.
+    """
+    if edges is None:
+        edges = np.arange(len(weights))
+    if len(edges) > count:
+        # Only the edges at least as heavy as the count'th heaviest one go to the heap.
+        cutoff = np.partition(weights[edges], len(edges) - count)[len(edges) - count]
+        edges = edges[weights[edges] >= cutoff]
+    items = itertools.izip((-weights[edges]).tolist(), u_ranks[edges].tolist(), v_ranks[edges].tolist(),
+                           edges.tolist())
+    return np.array([item[3] for item in heapq.nsmallest(count, items)], dtype=np.int64)
+
+
+def top_edges_per_term(weights, u_ranks, v_ranks, count):
+    """Returns the positions of the edges which are among the count heaviest edges of one of their terms."""
+    heaps = {}
+    items = itertools.izip(u_ranks.tolist(), v_ranks.tolist(), weights.tolist())
+    for edge, (u_rank, v_rank, weight) in enumerate(items):
+        for term, other in ((u_rank, v_rank), (v_rank, u_rank)):
+            heap = heaps.setdefault(term, [])
+            # Ties are won by the edges to the smaller terms.
+            item = (weight, -other, edge)
+            if len(heap) < count:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    return np.unique(np.array([entry[2] for entries in heaps.itervalues() for entry in entries], dtype=np.int64))
+
+
+def sorted_edges(weights, u_ranks, v_ranks, memory_budget=256, temp_dir=None):
+    """Yields the positions of the edges in the output order, in chunks.
+    Sorted runs are spilled to temp_dir if the sort needs more than memory_budget MB.
+    """
+    run_size = max(1, int(memory_budget * 1024 * 1024 / SORT_RECORD_SIZE))
+    if len(weights) <= run_size:
+        yield np.lexsort((v_ranks, u_ranks, -weights))
+        return
+
+    directory = tempfile.mkdtemp(dir=temp_dir)
+    try:
+        runs = []
+        for start in xrange(0, len(weights), run_size):
+            end = min(start + run_size, len(weights))
+            order = np.lexsort((v_ranks[start:end], u_ranks[start:end], -weights[start:end])) + start
+            run = np.empty(len(order), dtype=RUN_DTYPE)
+            run["weight"] = -weights[order]
+            run["u_rank"] = u_ranks[order]
+            run["v_rank"] = v_ranks[order]
+            run["edge"] = order
+            runs.append(os.path.join(directory, "run{0}.npy".format(len(runs))))
+            np.save(runs[-1], run)
+        logger.debug("Merging {0} sorted runs of the edges...".format(len(runs)))
+        merged = heapq.merge(*[read_run(np.load(path, mmap_mode="r")) for path in runs])
+        while True:
+            chunk = [item[3] for item in itertools.islice(merged, CHUNK_SIZE)]
+            if not chunk:
+                break
+            yield np.array(chunk, dtype=np.int64)
+    finally:
+        shutil.rmtree(directory)
+
+
+def read_run(run):
+    """Yields the records of a sorted run as tuples, reading CHUNK_SIZE records at a time."""
+    for start in xrange(0, len(run), CHUNK_SIZE):
+        for item in run[start:start + CHUNK_SIZE].tolist():
+            yield item
+
+
+def write_csv(hist, index, filename, top=None, top_per_term=None, memory_budget=256, temp_dir=None):
+    """Writes the "weight; term; term" rows of the edges sorted by weight, then by the terms.
+    @param top: write only the top heaviest edges.
+    @param top_per_term: write only the edges which are among the top_per_term heaviest edges of one
+    of their terms.
+    @param memory_budget: memory (MB) of the sort before the sorted runs are spilled to temp_dir.
+    """
+    u_ids, v_ids, weights = hist.arrays()
+    weights = np.asarray(weights, dtype=np.int64)
+    terms, u_ranks, v_ranks = term_ranks(index, u_ids, v_ids)
+
+    edges = None
+    if top_per_term:
+        edges = top_edges_per_term(weights, u_ranks, v_ranks, top_per_term)
+    if top:
+        chunks = [top_edges(weights, u_ranks, v_ranks, top, edges)]
+    elif edges is not None:
+        chunks = [edges[np.lexsort((v_ranks[edges], u_ranks[edges], -weights[edges]))]]
+    else:
+        chunks = sorted_edges(weights, u_ranks, v_ranks, memory_budget, temp_dir)
+
+    o = open(filename, "w")
+    separator = ""
+    for chunk in chunks:
+        for start in xrange(0, len(chunk), CHUNK_SIZE):
+            part = chunk[start:start + CHUNK_SIZE]
+            rows = ["{0}; {1}; {2}".format(weight, terms[u_rank], terms[v_rank]) for weight, u_rank, v_rank in
+                    itertools.izip(weights[part].tolist(), u_ranks[part].tolist(), v_ranks[part].tolist())]
+            if rows:
+                o.write(separator + "\n".join(rows))
+                separator = "\n"
+    o.close()
+
+
+WRITERS = {
+    "graphml": write_graphml,
+    "gexf": write_gexf,
+    "edges": write_edges,
+}
+
+EXTENSIONS = {
+    "graphml": "graphml",
+    "gexf": "gexf",
+    "edges": "zedges",
+}
+
+
+def write_graph(hist, index, filename, format="graphml"):
+    """Writes the edges of the histogram to filename in the given format, one of WRITERS."""
+    nodes, sources, targets, weights = graph_arrays(hist)
+    f = open(filename, "wb")
+    WRITERS[format](f, index, nodes, sources, targets, weights)
+    f.close()
+    logger.info("Wrote the graph with {0} nodes and {1} edges: {2}".format(len(nodes), len(sources), filename))
+
+
+def edge_keys(hist):
+    """Sorted packed keys of the edges of the histogram, the same for both directions of an edge."""
+    u_ids, v_ids, weights = hist.arrays()
+    return np.unique(pack(u_ids, v_ids))
+
+
+def write_edge_set(keys, index, filename):
+    """Writes the edges of the packed keys as "term-term" lines, the terms of each edge and the lines
+    in sorted order.
+    """
+    u_ids, v_ids = unpack(keys)
+    terms, u_ranks, v_ranks = term_ranks(index, u_ids, v_ids)
+    firsts, seconds = np.minimum(u_ranks, v_ranks), np.maximum(u_ranks, v_ranks)
+    order = np.lexsort((seconds, firsts))
+    o = open(filename, "w")
+    separator = ""
+    for part_firsts, part_seconds in chunks(firsts[order], seconds[order]):
+        rows = ["{0}-{1}".format(terms[first], terms[second]) for first, second in
+                itertools.izip(part_firsts, part_seconds)]
+        o.write(separator + "\n".join(rows))
+        separator = "\n"
+    o.close()
+    logger.info("Wrote {0} edges: {1}".format(len(keys), filename))
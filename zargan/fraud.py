@@ -0,0 +1,74 @@
+"""Early rejection of the fraud and bot IPs.
+
+check_fraud of process.py drops the IPs with more than per_ip searches only after all of their
+searches have been stored and grouped, and bots are the largest IPs. find_bots finds them in a
+pre-pass over the input which only keeps the IP and the date of each search, so their lines can be
+skipped before they are stored. It also finds the IPs that send bursts of searches: more than
+burst_count searches within burst_seconds.
+
+The rejected IPs can be added to a blocklist file, which clear.py --blocklist reads besides
+zargan/data/blocked_ips.txt, so the next runs drop them while cleaning.
+"""
+import os
+import logging
+from array import array
+
+import numpy as np
+
+from dates import parse_dates
+from records import DATE_BATCH
+
+logger = logging.getLogger("ZarganApp")
+
+
+def find_bots(fields, per_ip=None, burst_count=None, burst_seconds=60.0):
+    """Finds the IPs with more than per_ip searches and the IPs with more than burst_count searches
+    within burst_seconds. A check is skipped if its limit is None.
+    @param fields: splitted lines of the input, see records.read_fields.
+    @return: dict of the rejected IPs to the reason, "per_ip" or "burst".
+    """
+    ip_ids = {}
+    ips = array("i")
+    secs = array("l")
+    dates = []
+    for cols in fields:
+        ips.append(ip_ids.setdefault(cols[1], len(ip_ids)))
+        dates.append(cols[2])
+        if len(dates) == DATE_BATCH:
+            secs.fromstring(parse_dates(dates).astype(np.int_).tostring())
+            dates = []
+    secs.fromstring(parse_dates(dates).astype(np.int_).tostring())
+    ips = np.frombuffer(ips, dtype=np.intc)
+    secs = np.frombuffer(secs, dtype=np.int_)
+    names = [None] * len(ip_ids)
+    for ip, i in ip_ids.iteritems():
+        names[i] = ip
+
+    rejected = {}
+    if burst_count and len(ips) > burst_count:
+        # With the searches sorted by IP and date, a burst is burst_count + 1 searches of an IP
+        # within burst_seconds.
+        order = np.lexsort((secs, ips))
+        ips, secs = ips[order], secs[order]
+        bursts = (ips[burst_count:] == ips[:-burst_count]) & \
+                 (secs[burst_count:] - secs[:-burst_count] <= burst_seconds)
+        for i in np.unique(ips[burst_count:][bursts]).tolist():
+            rejected[names[i]] = "burst"
+    if per_ip is not None:
+        for i in np.flatnonzero(np.bincount(ips, minlength=len(names)) > per_ip).tolist():
+            rejected[names[i]] = "per_ip"
+    return rejected
+
+
+def write_blocklist(ips, filename):
+    """Adds the IPs to the blocklist file, one per line. The IPs already in the file are kept."""
+    blocked = set()
+    if os.path.exists(filename):
+        blocked.update(line.strip() for line in open(filename))
+        blocked.discard("")
+    count = len(blocked)
+    blocked.update(ip.encode("utf-8") for ip in ips)
+    o = open(filename, "w")
+    o.write("".join(ip + "\n" for ip in sorted(blocked)))
+    o.close()
+    logger.info("Added {0} IPs to the blocklist: {1}".format(len(blocked) - count, filename))
@@ -0,0 +1,216 @@
+# encoding: utf-8
+"""Generates synthetic search logs in the format of the Zargan stats files.
+
+Searches come in sessions of the IPs. The IPs are picked with a Zipfian distribution, so a few of
+them are very active. The searches of a session are seconds to minutes apart and are related to the
+topic of the session: a part of them are the neighbors of a topic term in the vocabulary, the rest
+are Zipfian picks from the whole vocabulary. Bot IPs send long bursts of random searches, which are
+caught by the per_ip and per_session limits of process.py.
+
+By default a raw stats file is written for clear.py: Windows-1254 encoded, with CRLF line endings,
+some corrupted lines and corporate searches. With --filtered, a utf-8 file in the format of the
+clear.py output is written for process.py instead. --dictionaries writes the dictionaries and the
+blocked IPs that clear.py expects in zargan/data.
+
+    python zargan/generate.py zargan/data/stats-synthetic.txt --searches 1000000 --dictionaries zargan/data
+"""
+import os
+import time
+import codecs
+import calendar
+import logging
+import argparse
+
+import numpy as np
+
+logger = logging.getLogger("ZarganApp")
+
+HEADER = u"Arama|IP|Tarih|UyeID|VisitorID|KurumID|CountTurkish|CountEnglish|Dil|Eklendi|TurkceYazim|SayfaNo"
+START_DATE = "2011-05-07 00:00:00"
+
+SYLLABLES = [u"ka", u"le", u"mi", u"no", u"ru", u"se", u"ta", u"vi", u"ba", u"de", u"ge", u"hi", u"lo",
+             u"ma", u"pe", u"ri", u"su", u"te", u"ya", u"zo", u"ar", u"el", u"in", u"on", u"ur"]
+TURKISH_SYLLABLES = [u"çı", u"ğa", u"şe", u"ö", u"ü", u"ış", u"çok", u"gül", u"süz", u"lık"]
+
+# Number of lines formatted at once.
+CHUNK_SIZE = 100000
+
+
+def zipf_choice(random, count, size, exponent):
+    """Draws size integers in [0, count), where i is picked with a probability proportional to
+    1 / (i + 1) ** exponent.
+    """
+    cdf = np.cumsum(1.0 / np.arange(1, count + 1) ** exponent)
+    return np.minimum(np.searchsorted(cdf, random.random_sample(size) * cdf[-1]), count - 1)
+
+
+def make_vocabulary(random, size):
+    """Returns size distinct terms. About one in five has Turkish characters, one in ten two words."""
+    terms = []
+    seen = set()
+    while len(terms) < size:
+        syllables = SYLLABLES if random.random_sample() < 0.8 else SYLLABLES + TURKISH_SYLLABLES
+        term = u"".join(syllables[i] for i in random.randint(0, len(syllables), random.randint(2, 5)))
+        if random.random_sample() < 0.1 and terms:
+            term = terms[random.randint(0, len(terms))] + u" " + term
+        if term not in seen:
+            seen.add(term)
+            terms.append(term)
+    return terms
+
+
+def make_ips(random, count):
+    """Returns count distinct IPv4 addresses, some of them zero padded like in the stats files."""
+    ips = []
+    seen = set()
+    while len(ips) < count:
+        parts = tuple(random.randint(1, 255, 4).tolist())
+        if parts in seen:
+            continue
+        seen.add(parts)
+        form = "%03d.%03d.%03d.%03d" if random.random_sample() < 0.2 else "%d.%d.%d.%d"
+        ips.append(form % parts)
+    return ips
+
+
+def generate_searches(random, searches, ips, vocabulary, exponent=1.1, bots=0.01, session_length=4.0,
+                      gap=40.0, days=1):
+    """Generates the searches.
+    @param bots: fraction of the IPs which are bots. Bots send about 5% of the searches.
+    @param session_length: average number of searches in a session.
+    @param gap: average number of seconds between the searches of a session.
+    @return: (ip positions, term positions, dates in seconds) arrays sorted by date.
+    """
+    span = days * 86400.0
+    bot_count = int(ips * bots)
+    bot_searches = int(searches * 0.05) if bot_count else 0
+
+    # Sessions of the normal IPs, each with a topic term.
+    lengths = random.geometric(1.0 / session_length, int(searches / session_length) + 1)
+    lengths = lengths[:np.searchsorted(np.cumsum(lengths), searches - bot_searches) + 1]
+    lengths[-1] -= max(0, lengths.sum() - (searches - bot_searches))
+    session_ips = bot_count + zipf_choice(random, ips - bot_count, len(lengths), 1.0)
+    session_starts = random.uniform(0, span, len(lengths))
+    topics = zipf_choice(random, vocabulary, len(lengths), exponent)
+
+    total = lengths.sum()
+    first = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    gaps = random.exponential(gap, total)
+    gaps[first] = 0
+    elapsed = np.cumsum(gaps)
+    dates = np.repeat(session_starts, lengths) + elapsed - np.repeat(elapsed[first], lengths)
+    terms = zipf_choice(random, vocabulary, total, exponent)
+    on_topic = random.random_sample(total) < 0.6
+    terms[on_topic] = (np.repeat(topics, lengths)[on_topic] + random.randint(0, 8, on_topic.sum())) % vocabulary
+    search_ips = np.repeat(session_ips, lengths)
+
+    # Bots search random terms every few seconds.
+    if bot_searches:
+        counts = np.bincount(random.randint(0, bot_count, bot_searches), minlength=bot_count)
+        bot_ips = np.repeat(np.arange(bot_count), counts)
+        active = counts > 0
+        elapsed = np.cumsum(random.uniform(1, 3, bot_searches))
+        elapsed -= np.repeat(elapsed[(np.cumsum(counts) - counts)[active]], counts[active])
+        bot_dates = np.repeat(random.uniform(0, span, bot_count)[active], counts[active]) + elapsed
+        search_ips = np.concatenate((search_ips, bot_ips))
+        terms = np.concatenate((terms, random.randint(0, vocabulary, bot_searches)))
+        dates = np.concatenate((dates, bot_dates))
+
+    order = np.argsort(dates, kind="mergesort")
+    return search_ips[order], terms[order], dates[order]
+
+
+def write_stats(filename, ips, vocabulary, search_ips, terms, dates, raw=True, random=None, corporate=0.02,
+                corrupted=0.002):
+    """Writes the searches as a stats file.
+    @param raw: write a raw stats file for clear.py, or a filtered file for process.py if False.
+    @param corporate, corrupted: fraction of the corporate searches and the corrupted lines of a raw file.
+    """
+    start = calendar.timegm(time.strptime(START_DATE, "%Y-%m-%d %H:%M:%S"))
+    if raw:
+        o = codecs.open(filename, "w", encoding="cp1254")
+        newline = u"\r\n"
+    else:
+        o = codecs.open(filename, "w", encoding="utf-8")
+        newline = u"\n"
+    o.write(HEADER + newline)
+
+    for chunk in xrange(0, len(dates), CHUNK_SIZE):
+        chunk_dates = dates[chunk:chunk + CHUNK_SIZE] + start
+        seconds = chunk_dates.astype(np.int64)
+        nanoseconds = ((chunk_dates - seconds) * 1e9).astype(np.int64)
+        kurum = np.zeros(len(seconds), dtype=bool)
+        broken = np.zeros(len(seconds), dtype=bool)
+        if raw:
+            kurum = random.random_sample(len(seconds)) < corporate
+            broken = random.random_sample(len(seconds)) < corrupted
+        lines = []
+        for ip, term, secs, nanos, is_kurum, is_broken in zip(
+                search_ips[chunk:chunk + CHUNK_SIZE].tolist(), terms[chunk:chunk + CHUNK_SIZE].tolist(),
+                seconds.tolist(), nanoseconds.tolist(), kurum.tolist(), broken.tolist()):
+            date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(secs))
+            if is_broken:
+                lines.append(u"%s|%s|%s" % (vocabulary[term], ips[ip], date))
+                continue
+            lines.append(u"%s|%s|%s.%09d||%d|%s|0|46|%d|0|0|" % (
+                vocabulary[term], ips[ip], date, nanos, ip + 1, u"1047" if is_kurum else u"", 1 + term % 2))
+        o.write(newline.join(lines) + newline)
+    o.close()
+
+
+def write_dictionaries(path, random, ips, vocabulary, unknown=0.05, blocked=0.01):
+    """Writes en_dict.txt, tr_dict.txt and blocked_ips.txt for clear.py into path.
+    @param unknown: fraction of the vocabulary missing from the dictionaries.
+    @param blocked: fraction of the IPs to block.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    words = set()
+    for term in vocabulary:
+        if random.random_sample() >= unknown:
+            words.update(term.split())
+    en = sorted(word for word in words if all(ord(c) < 128 for c in word))
+    tr = sorted(word for word in words if any(ord(c) >= 128 for c in word))
+    codecs.open(os.path.join(path, "en_dict.txt"), "w", encoding="ascii").write(u"\n".join(en))
+    codecs.open(os.path.join(path, "tr_dict.txt"), "w", encoding="utf-8").write(u"\n".join(tr))
+    # Without the zero padding of the stats files, like the blocklists written by hand.
+    blocked_ips = ["%d.%d.%d.%d" % tuple(map(int, ip.split("."))) for ip in ips if random.random_sample() < blocked]
+    open(os.path.join(path, "blocked_ips.txt"), "w").write("\n".join(blocked_ips))
+
+
+def generate(filename, searches=100000, ips=5000, vocabulary=20000, exponent=1.1, bots=0.01, days=1, seed=1,
+             raw=True, dictionaries=None):
+    """Writes a synthetic stats file, see the module documentation."""
+    logger.info("Generating {0} searches of {1} IPs into {2}...".format(searches, ips, filename))
+    random = np.random.RandomState(seed)
+    terms = make_vocabulary(random, vocabulary)
+    addresses = make_ips(random, ips)
+    search_ips, search_terms, dates = generate_searches(random, searches, ips, vocabulary, exponent, bots,
+                                                        days=days)
+    write_stats(filename, addresses, terms, search_ips, search_terms, dates, raw, random)
+    if dictionaries:
+        write_dictionaries(dictionaries, random, addresses, terms)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Generates a synthetic stats file.")
+    parser.add_argument("filename", help="output file")
+    parser.add_argument("--searches", type=int, default=100000, help="number of searches")
+    parser.add_argument("--ips", type=int, default=5000, help="number of IP addresses")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="number of distinct queries")
+    parser.add_argument("--zipf", type=float, default=1.1, help="exponent of the Zipfian query distribution")
+    parser.add_argument("--bots", type=float, default=0.01, help="fraction of the IPs which are bots")
+    parser.add_argument("--days", type=int, default=1, help="number of days the searches are spread over")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--filtered", action="store_true",
+                        help="write a utf-8 file like the output of clear.py instead of a raw stats file")
+    parser.add_argument("--dictionaries", default=None,
+                        help="directory to write the dictionaries and the blocked IPs for clear.py to")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    options = parse_args()
+    generate(options.filename, options.searches, options.ips, options.vocabulary, options.zipf, options.bots,
+             options.days, options.seed, not options.filtered, options.dictionaries)
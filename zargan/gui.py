@@ -1,20 +1,28 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from multiprocessing import Process
+from multiprocessing import Process, Queue, Event
+from Queue import Empty
 
 import os
 import sys
 
-from PyQt4.QtCore import SIGNAL
+from PyQt4.QtCore import SIGNAL, QTimer
 from PyQt4.QtGui import QApplication, QMainWindow, QGridLayout, QWidget, \
-    QPushButton, QLabel, QFileDialog, QLineEdit, QSpinBox, QCheckBox
+    QPushButton, QLabel, QFileDialog, QLineEdit, QSpinBox, QCheckBox, QPlainTextEdit
 
 from process import *
+from metrics import format_report
+from worker import serve
 
 
 class MainWindow(QMainWindow):
     def __init__(self):
         QMainWindow.__init__(self)
+        # The worker process keeps the data of the last run, see worker.py.
+        self.requests = Queue()
+        self.progress = Queue()
+        self.cancel = Event()
+        self.worker = None
         self.setupGUI()
 
     def setupGUI(self):
@@ -64,8 +72,20 @@ class MainWindow(QMainWindow):
         self.per_session_spin.setSingleStep(1)
 
 
+        self.workers_label = QLabel("Worker Processes")
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 64)
+        self.workers_spin.setValue(1)
+        self.workers_spin.setSingleStep(1)
+
+
         self.generate_graph_check = QCheckBox("Generate Graph")
         self.complete_chain_check = QCheckBox("Complete Chain")
+        self.metrics_check = QCheckBox("Collect Metrics")
+        self.metrics_view = QPlainTextEdit()
+        self.metrics_view.setReadOnly(True)
+        # Polls the progress of the worker.
+        self.timer = QTimer()
         self.start_button = QPushButton("Start")
         self.stop_button = QPushButton("Stop")
         #self.output_button = QPushButton("Display Output")
@@ -88,10 +108,15 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.per_session_label, 5, 0)
         layout.addWidget(self.per_session_spin, 5, 1)
 
-        layout.addWidget(self.generate_graph_check, 6, 0)
-        layout.addWidget(self.complete_chain_check, 7, 0)
-        layout.addWidget(self.start_button, 8, 0)
-        layout.addWidget(self.stop_button, 8, 1)
+        layout.addWidget(self.workers_label, 6, 0)
+        layout.addWidget(self.workers_spin, 6, 1)
+
+        layout.addWidget(self.generate_graph_check, 7, 0)
+        layout.addWidget(self.complete_chain_check, 8, 0)
+        layout.addWidget(self.metrics_check, 9, 0)
+        layout.addWidget(self.start_button, 10, 0)
+        layout.addWidget(self.stop_button, 10, 1)
+        layout.addWidget(self.metrics_view, 11, 0, 1, 3)
         #layout.addWidget(self.output_button, 7, 0)
 
 
@@ -104,6 +129,7 @@ class MainWindow(QMainWindow):
         self.connect(self.browse_button, SIGNAL('clicked()'), self.browseFile)
         self.connect(self.stop_button, SIGNAL('clicked()'), self.stop)
         self.connect(self.start_button, SIGNAL('clicked()'), self.start)
+        self.connect(self.timer, SIGNAL('timeout()'), self.checkProgress)
 
     def browseFile(self):
         self.input_file_edit.setText(QFileDialog.getOpenFileName())
@@ -115,25 +141,68 @@ class MainWindow(QMainWindow):
         prune_threshold = int(self.threshold_spin.text())
         per_ip = int(self.per_ip_spin.text())
         per_session = int(self.per_session_spin.text())
+        workers = int(self.workers_spin.text())
         generate_graph = self.generate_graph_check.isChecked()
         complete_chain = self.complete_chain_check.isChecked()
-
-        #params = (filename, item_count, window_size, prune_threshold, per_ip, per_session, generate_graph, complete_chain)
-        #self.app = ZarganApp(*params)
-        self.app = ZarganApp(filename=filename, item_count=item_count, window_size=window_size,
-                             prune_threshold=prune_threshold, per_ip=per_ip, per_session=per_session,
-                             generate_graph=generate_graph, complete_chain=complete_chain)
-
-        self.computation = Process(target=self.app.run, args=())
-        self.computation.start()
+        metrics_file = None
+        if self.metrics_check.isChecked():
+            metrics_file = "{0}-metrics.json".format(".".join(filename.split(".")[:-1]))
+
+        params = dict(filename=filename, item_count=item_count, window_size=window_size,
+                      prune_threshold=prune_threshold, per_ip=per_ip, per_session=per_session,
+                      generate_graph=generate_graph, complete_chain=complete_chain, workers=workers,
+                      metrics_file=metrics_file)
+
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = Process(target=serve, args=(self.requests, self.progress, self.cancel))
+            self.worker.start()
+        # Cleared here and not by the worker, so a Stop right after Start is not lost.
+        self.cancel.clear()
+        self.requests.put(params)
+        self.start_button.setEnabled(False)
+        self.metrics_view.clear()
+        self.showStatusMessage("Starting...")
+        self.timer.start(200)
+
+    def checkProgress(self):
+        """Shows the messages of the worker, and the metrics of the run when it finishes."""
+        while True:
+            try:
+                kind, value = self.progress.get_nowait()
+            except Empty:
+                break
+            if kind == "stage":
+                self.showStatusMessage("Running {0}...".format(value))
+                continue
+            self.timer.stop()
+            self.start_button.setEnabled(True)
+            if kind == "done":
+                self.showStatusMessage("Computation has finished... See the outputs.")
+                self.metrics_view.setPlainText("\n".join(format_report(value)))
+            elif kind == "cancelled":
+                self.showStatusMessage("Cancelled before {0}.".format(value))
+            else:
+                self.showStatusMessage("The computation has failed.")
+                self.metrics_view.setPlainText(value)
+            return
+        if not self.worker.is_alive():
+            self.timer.stop()
+            self.start_button.setEnabled(True)
+            self.showStatusMessage("The worker process has stopped.")
 
     def stop(self):
-        logger.info("Terminating the computation...")
-        self.computation.terminate()
-
-    def generate_graph(self):
-        self.app.generate_graph()
-        self.app.write_graph()
+        logger.info("Cancelling the computation...")
+        self.cancel.set()
+        self.showStatusMessage("Cancelling after the current stage...")
+
+    def closeEvent(self, event):
+        if self.worker is not None and self.worker.is_alive():
+            self.cancel.set()
+            self.requests.put(None)
+            self.worker.join(5)
+            if self.worker.is_alive():
+                self.worker.terminate()
+        QMainWindow.closeEvent(self, event)
 
     def showStatusMessage(self, message):
         self.statusBar().showMessage(message)
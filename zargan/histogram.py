@@ -0,0 +1,588 @@
+"""Co-occurrence histogram backends.
+
+A histogram counts the edges between query ids. Both backends support the same operations:
+add/add_pairs for counting, iteritems, prune and memory_size for the consumers, and
+shard/partial/merge for building the histogram in worker processes.
+
+DictHistogram is the original dict of (u_id, v_id) tuples where the direction of an edge is the
+reverse of its first occurrence. PackedHistogram keeps the edges in canonical (smaller id, larger id)
+order, packed into one int64 key, in sorted numpy arrays. Edges are appended in bulk and merged with
+a sort and reduce when the buffer is full, which takes a fraction of the memory of the dict.
+HeavyHitterHistogram only keeps the edges that can reach the prune threshold, in a fixed amount of
+memory. SpillHistogram counts the edges that do not fit in memory in hash partitions on disk and
+prunes them while each partition is reduced.
+"""
+import os
+import sys
+import math
+import shutil
+import tempfile
+import collections
+import itertools
+from array import array
+
+import numpy as np
+
+# Number of pending edges that triggers a reduce in PackedHistogram.
+BUFFER_SIZE = 1 << 22
+
+# Record of the spill files of SpillHistogram.
+EDGE = np.dtype([("key", np.int64), ("weight", np.int64)])
+
+
+def pack(u_ids, v_ids):
+    """Packs the pairs of ids into int64 keys. Keys are the same for (u, v) and (v, u)."""
+    u_ids = np.asarray(u_ids, dtype=np.int64)
+    v_ids = np.asarray(v_ids, dtype=np.int64)
+    return (np.minimum(u_ids, v_ids) << 32) | np.maximum(u_ids, v_ids)
+
+
+def unpack(keys):
+    """Returns the (u_ids, v_ids) arrays of the packed keys."""
+    return keys >> 32, keys & 0xffffffff
+
+
+def reduce_keys(keys, weights):
+    """Sorts the keys and sums the weights of the equal ones.
+    @return: (unique keys, weights) arrays.
+    """
+    if not len(keys):
+        return keys, weights
+    order = np.argsort(keys, kind="mergesort")
+    keys = keys[order]
+    weights = weights[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    return keys[starts], np.add.reduceat(weights, starts)
+
+
+class DictHistogram(collections.defaultdict):
+    # The result depends on the order in which the edges are added.
+    ordered = True
+
+    def __init__(self):
+        collections.defaultdict.__init__(self, int)
+
+    def add(self, u_id, v_id):
+        if (u_id, v_id) in self:
+            self[(u_id, v_id)] += 1
+        else:
+            self[(v_id, u_id)] += 1
+
+    def add_pairs(self, u_ids, v_ids, weights=None):
+        """Adds the edges u_ids[i] - v_ids[i] in the given order with the given weights (1 if None)."""
+        if weights is None:
+            weights = itertools.repeat(1)
+        else:
+            weights = np.asarray(weights).tolist()
+        for u_id, v_id, weight in itertools.izip(np.asarray(u_ids).tolist(), np.asarray(v_ids).tolist(), weights):
+            if (u_id, v_id) in self:
+                self[(u_id, v_id)] += weight
+            else:
+                self[(v_id, u_id)] += weight
+
+    def arrays(self):
+        """@return: (u_ids, v_ids, weights) arrays of the edges."""
+        edges = np.array([(u_id, v_id, weight) for (u_id, v_id), weight in self.iteritems()], dtype=np.int64)
+        edges = edges.reshape(-1, 3)
+        return edges[:, 0], edges[:, 1], edges[:, 2]
+
+    @classmethod
+    def from_arrays(cls, u_ids, v_ids, weights):
+        """Histogram with the given edges, in the given directions."""
+        hist = cls()
+        hist.update(itertools.izip(itertools.izip(u_ids.tolist(), v_ids.tolist()), weights.tolist()))
+        return hist
+
+    def prune(self, threshold):
+        """Removes the edges with weight < threshold."""
+        delete_list = collections.deque()
+        for (key, value) in self.iteritems():
+            if value < threshold:
+                delete_list.append(key)
+        for item in delete_list:
+            del self[item]
+
+    def memory_size(self):
+        """Approximate memory use in bytes, including the keys and the values."""
+        if not self:
+            return sys.getsizeof(self)
+        key, value = next(self.iteritems())
+        item_size = sys.getsizeof(key) + sum(sys.getsizeof(i) for i in key) + sys.getsizeof(value)
+        return sys.getsizeof(self) + len(self) * item_size
+
+    def shard(self):
+        """Histogram for a worker process."""
+        return ShardHistogram()
+
+    @classmethod
+    def merge(cls, partials):
+        """Merges the partial() results of the workers.
+        The first occurrence of an edge decides its direction, like in add.
+        """
+        hist = cls()
+        edges = [(ordinal, seq, worker, key, count)
+                 for worker, partial in enumerate(partials) for (ordinal, seq, key, count) in partial]
+        edges.sort()
+        for ordinal, seq, worker, (u_id, v_id), count in edges:
+            if (v_id, u_id) in hist:
+                hist[(v_id, u_id)] += count
+            else:
+                hist[(u_id, v_id)] += count
+        return hist
+
+
+class ShardHistogram(DictHistogram):
+    """DictHistogram of a worker process that remembers the order in which its edges are first seen.
+    ordinal is the position of the current IP in the serial iteration order.
+    """
+    def __init__(self):
+        DictHistogram.__init__(self)
+        self.first_seen = []
+        self.ordinal = None
+
+    def __missing__(self, key):
+        self.first_seen.append((self.ordinal, key))
+        return 0
+
+    def partial(self):
+        """@return: [(ordinal, seq, (u_id, v_id), weight), ...]"""
+        return [(ordinal, seq, key, self[key]) for seq, (ordinal, key) in enumerate(self.first_seen)]
+
+
+class PackedHistogram(object):
+    ordered = False
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        """Histogram keyed by packed int64 edges.
+        keys and weights are sorted, reduced arrays. Added edges wait in a buffer until reduce().
+        """
+        self.buffer_size = buffer_size
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.weights = np.zeros(0, dtype=np.int64)
+        self.pending_keys = []
+        self.pending_weights = []
+        self.pending_size = 0
+        self.singles = array("l")
+
+    def add(self, u_id, v_id):
+        self.singles.append(int(pack(u_id, v_id)))
+        if len(self.singles) >= self.buffer_size:
+            self.reduce()
+
+    def add_pairs(self, u_ids, v_ids, weights=None):
+        """Adds the edges u_ids[i] - v_ids[i] with the given weights (1 if None)."""
+        keys = pack(u_ids, v_ids)
+        if weights is None:
+            weights = np.ones(len(keys), dtype=np.int64)
+        self.pending_keys.append(keys)
+        self.pending_weights.append(np.asarray(weights, dtype=np.int64))
+        self.pending_size += len(keys)
+        if self.pending_size >= self.buffer_size:
+            self.reduce()
+
+    def reduce(self):
+        """Merges the pending edges into keys and weights."""
+        if len(self.singles):
+            self.pending_keys.append(np.frombuffer(self.singles, dtype=np.int_).astype(np.int64))
+            self.pending_weights.append(np.ones(len(self.singles), dtype=np.int64))
+            self.singles = array("l")
+        if not self.pending_keys:
+            return
+        self.keys, self.weights = reduce_keys(np.concatenate([self.keys] + self.pending_keys),
+                                              np.concatenate([self.weights] + self.pending_weights))
+        self.pending_keys = []
+        self.pending_weights = []
+        self.pending_size = 0
+
+    def __len__(self):
+        self.reduce()
+        return len(self.keys)
+
+    def __getitem__(self, edge):
+        self.reduce()
+        key = pack(edge[0], edge[1])
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            raise KeyError(edge)
+        return int(self.weights[i])
+
+    def arrays(self):
+        """@return: (u_ids, v_ids, weights) arrays of the edges where u_ids < v_ids."""
+        self.reduce()
+        u_ids, v_ids = unpack(self.keys)
+        return u_ids, v_ids, self.weights
+
+    @classmethod
+    def from_arrays(cls, u_ids, v_ids, weights):
+        """Histogram with the given edges."""
+        hist = cls()
+        hist.add_pairs(u_ids, v_ids, weights)
+        return hist
+
+    def iteritems(self):
+        """Yields ((u_id, v_id), weight) pairs."""
+        u_ids, v_ids, weights = self.arrays()
+        return itertools.izip(itertools.izip(u_ids.tolist(), v_ids.tolist()), weights.tolist())
+
+    def prune(self, threshold):
+        """Removes the edges with weight < threshold."""
+        self.reduce()
+        keep = self.weights >= threshold
+        self.keys = self.keys[keep]
+        self.weights = self.weights[keep]
+
+    def memory_size(self):
+        """Memory use of the arrays in bytes."""
+        return (self.keys.nbytes + self.weights.nbytes + self.pending_size * 16 +
+                len(self.singles) * self.singles.itemsize)
+
+    def shard(self):
+        """Histogram for a worker process."""
+        return PackedHistogram(self.buffer_size)
+
+    def partial(self):
+        self.reduce()
+        return self.keys, self.weights
+
+    @classmethod
+    def merge(cls, partials):
+        """Merges the partial() results of the workers."""
+        hist = cls()
+        hist.keys, hist.weights = reduce_keys(np.concatenate([keys for keys, _ in partials]),
+                                              np.concatenate([weights for _, weights in partials]))
+        return hist
+
+
+class HeavyHitterHistogram(PackedHistogram):
+    # Rows of the count-min sketch. Each row lowers the probability of a bad estimate by a factor of e.
+    DEPTH = 4
+    # The hash functions must be the same in all of the worker processes.
+    SEED = 4057
+
+    def __init__(self, threshold=2, memory=64, buffer_size=None):
+        """Approximate histogram that keeps only the candidates of the edges with weight >= threshold.
+
+        All of the edges are counted in a count-min sketch, which never underestimates a weight. When
+        the pending edges are reduced, the ones whose estimate reaches threshold become candidates. The
+        sketch still counts an edge after it is evicted from a full candidate set, so it becomes a
+        candidate again when it is added again. keys are the candidates; their weights are the sketch
+        estimates until exact_pass() is called.
+        @param memory: memory (MB) of the pending edges, the sketch and the candidates. A quarter is
+        left for the pending edges and their sorted copies, the rest is split half and half between
+        the sketch and the candidates.
+        @param buffer_size: number of pending edges, sized from memory if None.
+        """
+        budget = memory * 1024 * 1024
+        if buffer_size is None:
+            # 16 bytes of key and weight per edge, and the copies made while they are reduced.
+            buffer_size = max(1, min(BUFFER_SIZE, int(budget / 4 / 64)))
+        PackedHistogram.__init__(self, buffer_size)
+        self.threshold = threshold
+        self.memory = memory
+        part = (budget - self.buffer_size * 64) / 2
+        self.bits = max(1, int(math.log(max(part / (self.DEPTH * 8), 2), 2)))
+        self.sketch = np.zeros((self.DEPTH, 1 << self.bits), dtype=np.int64)
+        # Key, weight and exact weight of each candidate.
+        self.capacity = max(1, int(part / 24))
+        random = np.random.RandomState(self.SEED)
+        self.multipliers = random.randint(0, 1 << 62, self.DEPTH).astype(np.uint64) * 2 + 1
+        self.total = 0
+        # Largest estimate of an evicted candidate.
+        self.evicted = 0
+        self.exact = None
+
+    def hashes(self, keys):
+        """@return: column of each key in each row of the sketch (multiply-shift hashing)."""
+        keys = keys.astype(np.uint64)
+        shift = np.uint64(64 - self.bits)
+        return [((keys * multiplier) >> shift).astype(np.intp) for multiplier in self.multipliers]
+
+    def estimate(self, keys):
+        """Upper bounds of the weights of the keys."""
+        if not len(keys):
+            return np.zeros(0, dtype=np.int64)
+        return np.min([row[columns] for row, columns in itertools.izip(self.sketch, self.hashes(keys))], axis=0)
+
+    def add_pairs(self, u_ids, v_ids, weights=None):
+        """Adds the edges u_ids[i] - v_ids[i] with the given weights (1 if None).
+        During the exact pass only the weights of the candidates are counted.
+        """
+        if self.exact is None:
+            return PackedHistogram.add_pairs(self, u_ids, v_ids, weights)
+        keys = pack(u_ids, v_ids)
+        if not len(keys) or not len(self.keys):
+            return
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[positions] == keys
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.int64)[found]
+        self.exact += np.bincount(positions[found], weights, minlength=len(self.keys)).astype(np.int64)
+
+    def reduce(self):
+        """Counts the pending edges in the sketch and updates the candidates."""
+        if len(self.singles):
+            singles, self.singles = self.singles, array("l")
+            self.add_pairs(*unpack(np.frombuffer(singles, dtype=np.int_).astype(np.int64)))
+        if not self.pending_keys:
+            return
+        keys, weights = reduce_keys(np.concatenate(self.pending_keys), np.concatenate(self.pending_weights))
+        self.pending_keys = []
+        self.pending_weights = []
+        self.pending_size = 0
+        self.total += int(weights.sum())
+        for row, columns in itertools.izip(self.sketch, self.hashes(keys)):
+            row += np.bincount(columns, weights, minlength=len(row)).astype(np.int64)
+        self.add_candidates(keys[self.estimate(keys) >= self.threshold])
+
+    def add_candidates(self, keys):
+        """Adds keys to the candidates, evicting the ones with the smallest estimates if there are too many."""
+        keys = np.union1d(self.keys, keys)
+        weights = self.estimate(keys)
+        if len(keys) > self.capacity:
+            order = np.argsort(weights, kind="mergesort")
+            evicted, kept = order[:-self.capacity], np.sort(order[-self.capacity:])
+            self.evicted = max(self.evicted, int(weights[evicted].max()))
+            keys, weights = keys[kept], weights[kept]
+        self.keys, self.weights = keys, weights
+
+    def exact_pass(self):
+        """Starts counting the exact weights of the candidates. The edges must be added once more."""
+        self.reduce()
+        self.exact = np.zeros(len(self.keys), dtype=np.int64)
+
+    def arrays(self):
+        """@return: (u_ids, v_ids, weights) arrays of the candidates where u_ids < v_ids."""
+        self.reduce()
+        if self.exact is not None:
+            self.weights = self.exact
+        else:
+            self.weights = self.estimate(self.keys)
+        u_ids, v_ids = unpack(self.keys)
+        return u_ids, v_ids, self.weights
+
+    def prune(self, threshold):
+        """Removes the candidates with weight < threshold."""
+        weights = self.arrays()[2]
+        keep = weights >= threshold
+        self.keys = self.keys[keep]
+        self.weights = weights[keep]
+        if self.exact is not None:
+            self.exact = self.exact[keep]
+
+    def error_bound(self):
+        """@return: (overestimate, probability, missed): with the given probability, no estimate is
+        more than overestimate larger than its weight. Edges heavier than missed are always candidates.
+        """
+        self.reduce()
+        overestimate = math.e / self.sketch.shape[1] * self.total
+        return overestimate, 1 - math.exp(-self.DEPTH), self.evicted
+
+    def memory_size(self):
+        """Memory use of the sketch, the candidates and the pending edge buffer in bytes."""
+        exact = self.exact.nbytes if self.exact is not None else 0
+        return self.sketch.nbytes + self.keys.nbytes + self.weights.nbytes + exact + self.buffer_size * 64
+
+    def shard(self):
+        """Histogram for a worker process."""
+        return HeavyHitterHistogram(self.threshold, self.memory, self.buffer_size)
+
+    def partial(self):
+        self.reduce()
+        return self.sketch, self.keys, self.total, self.threshold, self.evicted
+
+    def merge(self, partials):
+        """Merges the partial() results of the workers into this histogram.
+        An edge that is missed by every worker was lighter than the threshold or evicted in each of them.
+        """
+        self.sketch = sum(sketch for sketch, _, _, _, _ in partials)
+        self.total = sum(total for _, _, total, _, _ in partials)
+        if any(evicted for _, _, _, _, evicted in partials):
+            self.evicted = sum(max(evicted, threshold - 1) for _, _, _, threshold, evicted in partials)
+        keys = np.unique(np.concatenate([keys for _, keys, _, _, _ in partials]))
+        self.add_candidates(keys[self.estimate(keys) >= self.threshold])
+        return self
+
+
+class SpillHistogram(PackedHistogram):
+    # Each spill is split into 2 ** PARTITION_BITS partitions.
+    PARTITION_BITS = 6
+    # A partition that does not fit in memory is split again with another hash, at most this many times.
+    SPLIT_LEVELS = 3
+    # The hash functions must be the same in all of the worker processes.
+    SEED = 7919
+
+    def __init__(self, threshold=1, memory=256, temp_dir=None):
+        """Exact out-of-core histogram for the edges that do not fit in memory.
+
+        The pending edges are reduced in memory like in PackedHistogram. When the reduced edges take a
+        quarter of memory (the rest is left for the sorts) they are appended to partition files on disk,
+        chosen by the hash of the key, so all of the counts of an edge end up in the same partition.
+        The first operation that reads the histogram reduces the partitions one by one, drops the edges
+        with weight < threshold of each and merges the rest into keys and weights, which are then the
+        same as the ones of a pruned PackedHistogram. Edges can not be added after that.
+        @param memory: memory (MB) of the edges in memory and of a partition while it is reduced.
+        @param temp_dir: directory for the partition files. System default if None.
+        """
+        self.memory = memory
+        PackedHistogram.__init__(self, max(1, min(BUFFER_SIZE, int(memory * 1024 * 1024 / 64))))
+        self.threshold = threshold
+        self.temp_dir = temp_dir
+        # Directories of the partition files: the one of this histogram and the ones of the workers.
+        self.directory = None
+        self.directories = []
+        self.spills = 0
+        # Number of the edges dropped by the reduce.
+        self.pruned = 0
+        self.reduced = False
+        random = np.random.RandomState(self.SEED)
+        self.multipliers = random.randint(0, 1 << 62, self.SPLIT_LEVELS + 1).astype(np.uint64) * 2 + 1
+
+    def partitions(self, keys, level):
+        """@return: partition of each key at the given split level (multiply-shift hashing)."""
+        shift = np.uint64(64 - self.PARTITION_BITS)
+        return ((keys.astype(np.uint64) * self.multipliers[level]) >> shift).astype(np.intp)
+
+    def write_partitions(self, keys, weights, directory, level):
+        """Appends the edges to the partition files in the directory."""
+        partitions = self.partitions(keys, level)
+        order = np.argsort(partitions, kind="mergesort")
+        edges = np.empty(len(keys), dtype=EDGE)
+        edges["key"], edges["weight"] = keys[order], weights[order]
+        bounds = np.searchsorted(partitions[order], np.arange((1 << self.PARTITION_BITS) + 1)).tolist()
+        for partition in xrange(1 << self.PARTITION_BITS):
+            if bounds[partition] < bounds[partition + 1]:
+                f = open(os.path.join(directory, "{0}.edges".format(partition)), "ab")
+                edges[bounds[partition]:bounds[partition + 1]].tofile(f)
+                f.close()
+
+    def add_pairs(self, u_ids, v_ids, weights=None):
+        if self.reduced:
+            raise ValueError("Edges can not be added to a spill histogram after it has been reduced.")
+        PackedHistogram.add_pairs(self, u_ids, v_ids, weights)
+
+    def reduce(self):
+        """Reduces the pending edges in memory and spills them if they take too much memory."""
+        PackedHistogram.reduce(self)
+        if not self.reduced and self.keys.nbytes + self.weights.nbytes > self.memory * 1024 * 1024 / 4:
+            self.spill()
+
+    def spill(self):
+        """Appends the edges in memory to the partition files."""
+        if not len(self.keys):
+            return
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="zargan-spill-", dir=self.temp_dir)
+            self.directories.append(self.directory)
+        self.write_partitions(self.keys, self.weights, self.directory, 0)
+        self.spills += 1
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.weights = np.zeros(0, dtype=np.int64)
+
+    def reduce_partition(self, filenames, level):
+        """Yields the (keys, weights) of the edges with weight >= threshold in the partition files.
+        A partition larger than memory is split into partitions of the next level first.
+        """
+        if sum(os.path.getsize(filename) for filename in filenames) > self.memory * 1024 * 1024 / 4 and \
+                level < self.SPLIT_LEVELS:
+            directory = tempfile.mkdtemp(prefix="zargan-spill-", dir=self.temp_dir)
+            try:
+                for filename in filenames:
+                    f = open(filename, "rb")
+                    while True:
+                        edges = np.fromfile(f, dtype=EDGE, count=self.buffer_size)
+                        if not len(edges):
+                            break
+                        keys, weights = reduce_keys(edges["key"], edges["weight"])
+                        self.write_partitions(keys, weights, directory, level + 1)
+                    f.close()
+                    os.remove(filename)
+                for partition in xrange(1 << self.PARTITION_BITS):
+                    part = os.path.join(directory, "{0}.edges".format(partition))
+                    if os.path.exists(part):
+                        for result in self.reduce_partition([part], level + 1):
+                            yield result
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            return
+        edges = np.concatenate([np.fromfile(filename, dtype=EDGE) for filename in filenames])
+        for filename in filenames:
+            os.remove(filename)
+        keys, weights = reduce_keys(edges["key"], edges["weight"])
+        keep = weights >= self.threshold
+        self.pruned += len(keys) - int(keep.sum())
+        yield keys[keep], weights[keep]
+
+    def reduce_partitions(self):
+        """Reduces and prunes all of the edges, see __init__. Does nothing after the first call."""
+        if self.reduced:
+            return
+        self.reduce()
+        self.reduced = True
+        if not self.directories:
+            # Everything fits in memory.
+            keep = self.weights >= self.threshold
+            self.pruned += len(self.keys) - int(keep.sum())
+            self.keys, self.weights = self.keys[keep], self.weights[keep]
+            return
+        self.spill()
+        results = [(self.keys, self.weights)]
+        try:
+            for partition in xrange(1 << self.PARTITION_BITS):
+                filenames = [os.path.join(directory, "{0}.edges".format(partition)) for directory in self.directories]
+                filenames = [filename for filename in filenames if os.path.exists(filename)]
+                if filenames:
+                    results.extend(self.reduce_partition(filenames, 0))
+        finally:
+            for directory in self.directories:
+                shutil.rmtree(directory, ignore_errors=True)
+            self.directories = []
+        # The pruned edges of the partitions fit in memory.
+        keys = np.concatenate([keys for keys, _ in results])
+        order = np.argsort(keys, kind="mergesort")
+        self.keys, self.weights = keys[order], np.concatenate([weights for _, weights in results])[order]
+
+    def __len__(self):
+        self.reduce_partitions()
+        return len(self.keys)
+
+    def __getitem__(self, edge):
+        self.reduce_partitions()
+        return PackedHistogram.__getitem__(self, edge)
+
+    def arrays(self):
+        """@return: (u_ids, v_ids, weights) arrays of the edges with weight >= threshold where u_ids < v_ids."""
+        self.reduce_partitions()
+        return PackedHistogram.arrays(self)
+
+    def prune(self, threshold):
+        """Removes the edges with weight < threshold. The ones below the threshold of the histogram are
+        already removed by the reduce.
+        """
+        self.reduce_partitions()
+        PackedHistogram.prune(self, threshold)
+
+    def shard(self):
+        """Histogram for a worker process."""
+        return SpillHistogram(self.threshold, self.memory, self.temp_dir)
+
+    def partial(self):
+        """Spills all of the edges of a worker.
+        @return: (directory of the partition files or None if there are no edges, number of spills)
+        """
+        PackedHistogram.reduce(self)
+        self.spill()
+        return self.directory, self.spills
+
+    def merge(self, partials):
+        """Adds the partition files of the workers to this histogram; they are reduced together."""
+        self.directories.extend(directory for directory, _ in partials if directory is not None)
+        self.spills += sum(spills for _, spills in partials)
+        return self
+
+
+HISTOGRAMS = {
+    "dict": DictHistogram,
+    "packed": PackedHistogram,
+    "heavy": HeavyHitterHistogram,
+    "spill": SpillHistogram,
+}
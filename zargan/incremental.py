@@ -0,0 +1,74 @@
+"""Persisted state of the incremental (daily) ingestion mode.
+
+The state keeps everything that is needed to continue with the next file as if all of the files
+were processed in one run: the vocabulary, the unpruned edge counts of the closed sessions and the
+searches of the sessions which were still open at the end of the last file.
+"""
+import os
+import logging
+import cPickle as pickle
+
+import numpy as np
+
+from vocabulary import Vocabulary
+
+logger = logging.getLogger("ZarganApp")
+
+
+class IngestState(object):
+    VERSION = 1
+
+    def __init__(self, params):
+        """
+        @param params: parameters that change the histogram. A state can only be continued with the same ones.
+        """
+        self.params = params
+        self.index = Vocabulary()
+        # (u_ids, v_ids, weights) of the closed sessions.
+        self.edges = (np.zeros(0, dtype=np.int64),) * 3
+        # ip -> ([date, date, ...], [query_id, query_id, ...]) of the open session.
+        self.sessions = {}
+        self.last_date = None
+        self.files = []
+
+    @classmethod
+    def load(cls, filename, params):
+        """Loads the state from filename, or returns an empty state if the file does not exist."""
+        if not os.path.exists(filename):
+            logger.info("No state in {0}, starting from scratch.".format(filename))
+            return cls(params)
+        f = open(filename, "rb")
+        data = pickle.load(f)
+        f.close()
+        if data["version"] != cls.VERSION:
+            raise ValueError("Unsupported state version in {0}: {1}".format(filename, data["version"]))
+        if data["params"] != params:
+            raise ValueError("The state in {0} was built with different parameters: {1}".format(
+                filename, data["params"]))
+
+        state = cls(params)
+        state.index.get_indexes_of(data["terms"])
+        state.edges = data["edges"]
+        state.sessions = data["sessions"]
+        state.last_date = data["last_date"]
+        state.files = data["files"]
+        logger.info("Loaded the state of {0} files: {1} terms, {2} edges, {3} open sessions.".format(
+            len(state.files), len(state.index), len(state.edges[0]), len(state.sessions)))
+        return state
+
+    def save(self, filename):
+        """Writes the state to a temporary file first, so a failed run never leaves a broken state."""
+        data = {
+            "version": self.VERSION,
+            "params": self.params,
+            "terms": self.index.terms_of(np.arange(1, len(self.index) + 1)),
+            "edges": self.edges,
+            "sessions": self.sessions,
+            "last_date": self.last_date,
+            "files": self.files,
+        }
+        f = open(filename + ".tmp", "wb")
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+        os.rename(filename + ".tmp", filename)
+        logger.info("Saved the state to {0}.".format(filename))
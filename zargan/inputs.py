@@ -0,0 +1,166 @@
+"""Plain and compressed input files.
+
+An input is a path, a glob pattern or a list of them. The files are read one after the other, the
+matches of a pattern sorted by name. Files ending in .gz, .bz2 and .xz are decompressed while they
+are read, so the archived stats files do not have to be decompressed to disk first:
+
+    python zargan/clear.py "zargan/data/stats201109*.txt.gz" zargan/data/filtered.txt
+    python zargan/process.py "zargan/data/filtered-*.txt.bz2" 10000000 300 3
+
+A reader thread reads and decompresses blocks of BLOCK_SIZE bytes ahead of the parsing; zlib and bz2
+release the GIL while decompressing, so the decompression overlaps the parsing. The first line of
+each file is its header. Reading .xz files needs the lzma module (backports.lzma on Python 2).
+"""
+import os
+import sys
+import bz2
+import glob
+import gzip
+import Queue
+import codecs
+import threading
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Number of decompressed bytes read at once.
+BLOCK_SIZE = 1 << 22
+
+# Number of blocks the reader thread reads ahead of the parsing.
+READ_AHEAD = 4
+
+
+def open_xz(filename):
+    if lzma is None:
+        raise ValueError("Reading .xz files needs the lzma module (backports.lzma on Python 2): {0}".format(
+            filename))
+    return lzma.LZMAFile(filename, "rb")
+
+
+OPENERS = {
+    ".gz": lambda filename: gzip.GzipFile(filename, "rb"),
+    ".bz2": lambda filename: bz2.BZ2File(filename, "rb"),
+    ".xz": open_xz,
+}
+
+
+def expand(filename):
+    """Returns the files of the input.
+    @raise IOError: if a pattern does not match any files.
+    """
+    patterns = [filename] if isinstance(filename, basestring) else filename
+    files = []
+    for pattern in patterns:
+        if not glob.has_magic(pattern):
+            files.append(pattern)
+            continue
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise IOError("No files match {0}".format(pattern))
+        files.extend(matches)
+    return files
+
+
+def is_compressed(filename):
+    return os.path.splitext(filename)[1].lower() in OPENERS
+
+
+def is_plain_file(filename):
+    """Returns True if the input is a single uncompressed file."""
+    files = expand(filename)
+    return len(files) == 1 and not is_compressed(files[0])
+
+
+def is_directory(filename):
+    """Returns True if the input is a directory, e.g. converted with convert.py."""
+    return isinstance(filename, basestring) and os.path.isdir(filename)
+
+
+def output_name(filename):
+    """Name of the input for the names of the outputs: its first file without the compression extension."""
+    name = expand(filename)[0]
+    return os.path.splitext(name)[0] if is_compressed(name) else name
+
+
+def open_file(filename):
+    """Opens the file for reading in binary mode, decompressing it if it is compressed."""
+    opener = OPENERS.get(os.path.splitext(filename)[1].lower())
+    return open(filename, "rb") if opener is None else opener(filename)
+
+
+def put(blocks, stop, item):
+    """Puts the item into the queue unless stop is set first. Returns False if it is not put."""
+    while not stop.is_set():
+        try:
+            blocks.put(item, timeout=0.1)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+
+def read_blocks(files, blocks, stop):
+    """Reader thread of read_lines. Puts the blocks of each file into the queue and an empty block at
+    the end of each file. If reading fails, the exception info is put instead.
+    """
+    try:
+        for filename in files:
+            f = open_file(filename)
+            try:
+                while True:
+                    block = f.read(BLOCK_SIZE)
+                    if not put(blocks, stop, block):
+                        return
+                    if not block:
+                        break
+            finally:
+                f.close()
+    except Exception:
+        put(blocks, stop, sys.exc_info())
+
+
+def read_lines(filename, encoding="utf-8", headers=False):
+    """Yields the decoded lines of the files of the input, split like the lines of codecs.open.
+    @param headers: also yield the first line of each file.
+    """
+    files = expand(filename)
+    blocks = Queue.Queue(READ_AHEAD)
+    stop = threading.Event()
+    reader = threading.Thread(target=read_blocks, args=(files, blocks, stop))
+    reader.daemon = True
+    reader.start()
+    try:
+        for _ in files:
+            decoder = codecs.getincrementaldecoder(encoding)()
+            rest = u""
+            header = not headers
+            while True:
+                block = blocks.get()
+                if isinstance(block, tuple):
+                    raise block[0], block[1], block[2]
+                lines = (rest + decoder.decode(block, not block)).splitlines(True)
+                rest = u""
+                # The last line may continue in the next block, and so may a "\r" before a "\n".
+                if block and lines and (lines[-1].splitlines()[0] == lines[-1] or lines[-1].endswith(u"\r")):
+                    rest = lines.pop()
+                if header and lines:
+                    lines = lines[1:]
+                    header = False
+                for line in lines:
+                    yield line
+                if not block:
+                    break
+    finally:
+        stop.set()
+
+
+def read_header(filename, encoding="utf-8"):
+    """Returns the first line of the first file of the input."""
+    for line in read_lines(expand(filename)[0], encoding, headers=True):
+        return line
+    return u""
@@ -0,0 +1,106 @@
+"""Per-stage metrics of ZarganApp.run.
+
+Each stage records its wall time, its CPU time (of this process and of the worker processes that
+finished during the stage), the resident memory after it, the change of the resident memory and the
+peak resident memory so far. Stages that process records or IPs also get their throughput. Counters
+collect the number of rejected IPs, suspicious sessions and pruned edges.
+
+The report is written as JSON with --metrics; --profile also dumps a cProfile of the run.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger("ZarganApp")
+
+
+def rss():
+    """Current resident memory of the process in MB, or None if it is not available."""
+    try:
+        pages = int(open("/proc/self/statm").read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024.0 / 1024.0
+
+
+def peak_rss():
+    """Peak resident memory of the process in MB, or None if it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes.
+    return peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+
+
+class Metrics(object):
+    def __init__(self):
+        self.stages = []
+        self.counters = {}
+        self.start = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measures the block as the stage name. Yields the dict of the stage, where the number of
+        processed "records" and "ips" can be set for the throughput.
+        """
+        record = {"stage": name}
+        start, times, memory = time.time(), os.times(), rss()
+        try:
+            yield record
+        finally:
+            end_times = os.times()
+            record["seconds"] = round(time.time() - start, 6)
+            record["cpu_seconds"] = round(end_times[0] + end_times[1] - times[0] - times[1], 6)
+            record["worker_cpu_seconds"] = round(end_times[2] + end_times[3] - times[2] - times[3], 6)
+            record["rss_mb"] = rss()
+            record["rss_delta_mb"] = None if memory is None else record["rss_mb"] - memory
+            record["peak_mb"] = peak_rss()
+            for key in ("records", "ips"):
+                if key in record and record["seconds"] > 0:
+                    record[key + "_per_second"] = record[key] / record["seconds"]
+            self.stages.append(record)
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def report(self):
+        return {
+            "seconds": time.time() - self.start,
+            "peak_mb": peak_rss(),
+            "stages": self.stages,
+            "counters": self.counters,
+        }
+
+    def write(self, filename):
+        f = open(filename, "w")
+        json.dump(self.report(), f, indent=2, sort_keys=True)
+        f.close()
+        logger.info("Wrote the metrics: {0}".format(filename))
+
+    def summary(self):
+        """Returns the report as lines of text."""
+        return format_report(self.report())
+
+
+def format_report(report):
+    """Returns a report written by Metrics.write as lines of text."""
+    lines = []
+    for record in report["stages"]:
+        line = "{0:<20} {1:8.2f} s {2:8.2f} s CPU".format(record["stage"], record["seconds"],
+                                                         record["cpu_seconds"] + record["worker_cpu_seconds"])
+        if record["rss_mb"] is not None:
+            line += " {0:8.1f} MB ({1:+.1f} MB)".format(record["rss_mb"], record["rss_delta_mb"])
+        for key in ("records", "ips"):
+            if key + "_per_second" in record:
+                line += " {0:.0f} {1}/s".format(record[key + "_per_second"], key)
+        lines.append(line)
+    lines.extend("{0}: {1}".format(name, value) for name, value in sorted(report["counters"].iteritems()))
+    return lines
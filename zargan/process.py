@@ -17,79 +17,36 @@ Arama|IP|Tarih|UyeID|VisitorID|KurumID|CountTurkish|CountEnglish|Dil|Eklendi|Tur
 tide |078.171.172.145|2011-05-07 05:32:47.780000000||67983982||0|46|2|0|0|
 
 """
-import sys
-import codecs
-import collections
-import datetime
-import time
 import itertools
+import operator
 import logging
+import argparse
+import os
+import zlib
+import cProfile
+import multiprocessing
 
+import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
 
+from stream import ExternalSorter
+from records import Record, RecordStore, read_fields
+from vocabulary import Vocabulary
+from histogram import HISTOGRAMS, BUFFER_SIZE, HeavyHitterHistogram, SpillHistogram
+from incremental import IngestState
+import sweep
+import export
+import related
+import fraud
+import inputs
+import analytics
+from metrics import Metrics, rss
+
 logger = logging.getLogger("ZarganApp")
 logging.basicConfig(level=logging.DEBUG)
 
 
-class Index(object):
-    def __init__(self):
-        self.id_to_value = {}
-        self.value_to_id = {}
-        self.last_id = 0
-
-    def get_index_of(self, value):
-        result = self.value_to_id.get(value)
-        if result:
-            return result
-        else:
-            self.last_id += 1
-            self.id_to_value[self.last_id] = value
-            self.value_to_id[value] = self.last_id
-            return self.last_id
-
-    def get_value_of(self, key):
-        result = self.id_to_value.get(key)
-        if not result:
-            raise KeyError, "This key ({0}) does not exist in the index.".format(key)
-        return result
-
-
-class Record(object):
-    def __init__(self, fields):
-        self.arama = fields[0].lower()
-        self.ip = fields[1]
-        self.tarih = fields[2].split(".")[0]
-        #self.uye_id = fields[3]
-        #self.visitor_id = fields[4]
-        #self.kurum_id = fields[5]
-        #self.count_turkish = fields[6]
-        #self.count_english = fields[7]
-        #self.dil = fields[8]
-        #self.eklendi = fields[9]
-        #self.turkce_yazim = fields[10]
-        #self.sayfa_no = fields[11]
-        self.secs = None
-
-    def __str__(self):
-        return ("Tarih: %(tarih)-29s\t IP: %(ip)s\t Kurum: %(kurum_id)s\t arama: %(arama)s\t" % self.__dict__).encode(
-            "utf8")
-        #return "|".join(["%s: %s" % (key, value) for key,value in self.__dict__.iteritems()])
-
-    def __repr__(self):
-        return self.arama.encode("utf8")
-        #return ("Tarih: %(tarih)-29s\t IP: %(ip)s\t Kurum: %(kurum_id)s\t arama: %(arama)s\t" % self.__dict__).encode("utf8")
-
-    def get_date_in_secs(self):
-        """
-        Returns the date of the record in seconds.
-        """
-        if self.secs:
-            return self.secs
-        self.secs = time.mktime(datetime.datetime.strptime(self.tarih, "%Y-%m-%d %H:%M:%S").timetuple())
-        return self.secs
-
-
 class OccurrenceGraph(nx.Graph):
     def __init__(self):
         nx.Graph.__init__(self)
@@ -108,68 +65,125 @@ class OccurrenceGraph(nx.Graph):
     def prune(self, threshold=2):
         logger.info("Pruning the graph...")
         logger.info("Nodes: {0}; Edges: {1}".format(self.number_of_nodes(), self.number_of_edges()))
-        for edge in self.edges(data=True):
-            if edge[2]['weight'] < threshold:
-                self.remove_edge(edge[0], edge[1])
-
-        for node in self.nodes():
-            if not self.degree(node):
-                self.remove_node(node)
+        # The light edges and then the isolated nodes are removed at once.
+        self.remove_edges_from([(u, v) for u, v, data in self.edges(data=True) if data['weight'] < threshold])
+        self.remove_nodes_from([node for node, degree in self.degree().iteritems() if not degree])
         logger.info("Nodes: {0}; Edges: {1}".format(self.number_of_nodes(), self.number_of_edges()))
 
     def write_graphml(self, filename):
         nx.write_graphml(self, filename)
 
 
-def cluster(data, window_size=300.0):
-    """Clusters the data points according to window size
-    @param data: [ (second, Record), (second, Record), ... ]
+def cluster(dates, window_size=300.0, group_bounds=None):
+    """Clusters the searches into sessions according to window size.
+    Two consecutive searches are in the same session if they are at most window_size seconds apart.
+    @param dates: numpy array of the search dates in seconds, sorted for each IP.
     @param window_size: maximum seperation between two points in a cluster.
-    TODO: Test this
+    @param group_bounds: the dates of the i'th IP are dates[group_bounds[i]:group_bounds[i + 1]].
+    Sessions never span two IPs. None if all of the dates belong to a single IP.
+    @return: session boundaries; the i'th session is dates[bounds[i]:bounds[i + 1]].
     """
-    # Start with the initial item.
-    current_cluster = [data[0]]
-    i = 0
-    N = len(data)
-    #print data
-    # for all items except for the last one,
-    while i < N - 1:
-        current_item = data[i]
-        next_item = data[i + 1]
-
-        # if the time between two consecutive searches are less than the window size,
-        if next_item[0] - current_item[0] <= window_size:
-            # add the item to the current cluster. They should be related.
-            current_cluster.append(data[i + 1])
-        else:
-            # if not, finalize the cluster and yield it.
-            a = current_cluster
-            current_cluster = [data[i + 1]]
-            yield a
-            # TODO: check if this works properly.
+    breaks = np.diff(dates) > window_size
+    if group_bounds is not None:
+        # The first search of each IP starts a new session.
+        breaks[group_bounds[1:-1] - 1] = True
+    return np.concatenate(([0], np.flatnonzero(breaks) + 1, [len(dates)]))
 
-        i += 1
 
-    # yield the last current cluster
-    yield list(set(current_cluster))
+def ranges(starts, ends):
+    """Concatenation of arange(start, end) for each start, end pair."""
+    lengths = ends - starts
+    offsets = starts - np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.arange(lengths.sum()) + np.repeat(offsets, lengths)
+
+
+def session_pairs(starts, ends):
+    """Positions of all of the pairs in each session, in the order of itertools.combinations.
+    @return: (firsts, seconds) arrays where firsts[i] < seconds[i].
+    """
+    # Each search is paired with the searches after it in its session.
+    firsts = ranges(starts, ends - 1)
+    row_ends = np.repeat(ends, ends - starts - 1)
+    return np.repeat(firsts, row_ends - firsts - 1), ranges(firsts + 1, row_ends)
+
+
+def build_shard_histogram(args):
+    """Worker of ZarganApp.generate_histogram_parallel.
+    @param args: (ZarganApp parameters, query_ids, starts, ends, ordinals) where starts and ends are the
+    sessions of the shard in query_ids, and ordinals are the positions of their IPs in the serial order.
+    @return: partial histogram, see histogram.py.
+    """
+    params, query_ids, starts, ends, ordinals = args
+    app = ZarganApp(**params)
+    app.occurrence_histogram = hist = app.create_histogram().shard()
+    if not hist.ordered:
+        app.chain(query_ids, starts, ends)
+        return hist.partial()
+    # Edges are added IP by IP to keep track of their first occurrences.
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(ordinals)) + 1, [len(ordinals)])).tolist()
+    for a, b in itertools.izip(bounds[:-1], bounds[1:]):
+        hist.ordinal = ordinals[a]
+        app.chain(query_ids, starts[a:b], ends[a:b])
+    return hist.partial()
+
+
+def write_searches(f, ip, searches):
+    """Writes the searches of an IP as a line of the hashmap file."""
+    f.write("{ip}\t{records}\n".format(ip=ip, records=";".join(map(lambda x: x.arama.encode("utf-8"), searches))))
 
 
 class ZarganApp(object):
     def __init__(self, filename="zargan/data/filtered.txt", item_count=2400000, window_size=300.0, prune_threshold=20,
                  per_ip=1000, per_session=100,
-                 generate_graph=None, complete_chain=False):
+                 generate_graph=None, complete_chain=False, streaming=False, memory_budget=256, temp_dir=None,
+                 workers=1, histogram="packed", state_file=None, heavy_memory=64, heavy_exact=False,
+                 graph_format="graphml", top=None, top_per_term=None, related_index=None,
+                 metrics_file=None, profile_file=None, compare_chains=False, early_rejection=False,
+                 burst_count=None, burst_seconds=60.0, blocklist_file=None, vocabulary=None, communities=None,
+                 k_core=None):
         """Main Application that takes the search data in and finds the co-searched terms.
         Adds edges between those terms and generates a graph. Applies pruning and displays the results.
         Resulting graph is expected to reflect meaningful relationships between nodes (words) that are
         connected to each other.
 
-        @param filename: input filename
+        @param filename: input file, glob pattern or list of them; the files may be compressed, see inputs.py.
+        The outputs are named after the first file.
         @param item_count: take first X lines as input
         @param window_size: Maximum time seperation in seconds between two searches.
         @param prune_threshold: Remove all edges below weight X.
+        @param streaming: group the records by IP with an external sort instead of keeping them all in memory.
+        @param memory_budget: memory (MB) the streaming mode may use for buffering records before spilling to disk,
+        and the spill histogram for the edges.
+        @param temp_dir: directory for the spill files of the streaming mode and the spill histogram.
+        @param workers: number of processes that build the histogram. IPs are sharded among them by hash.
+        @param histogram: histogram backend, one of histogram.HISTOGRAMS.
+        @param state_file: incremental mode; continue from the state of the previous files saved in this file.
+        @param heavy_memory: memory (MB) of the heavy histogram, which only keeps the edges that may reach prune_threshold.
+        It is shared by the worker processes.
+        @param heavy_exact: count the exact weights of the heavy histogram candidates with a second pass.
+        @param graph_format: format of the graph file, one of export.WRITERS.
+        @param top: write only the top heaviest edges to the output file.
+        @param top_per_term: write only the edges which are among the top_per_term heaviest edges of a term.
+        @param related_index: directory to write the related terms index of the pruned histogram to, see related.py.
+        @param metrics_file: write the time, memory and counters of each stage of run() to this JSON file.
+        @param profile_file: write a cProfile dump of run() to this file.
+        @param compare_chains: build the histograms of both chaining methods in one pass and write the edges
+        they share and the edges of only one of them to the compare-chain-*.txt files next to the input.
+        The outputs are the ones of the method selected by complete_chain.
+        @param early_rejection: find the IPs with more than per_ip searches in a pre-pass and skip their lines
+        before they are stored, see fraud.py.
+        @param burst_count: the pre-pass also rejects the IPs with more than burst_count searches within
+        burst_seconds. Implies early_rejection.
+        @param blocklist_file: add the IPs rejected by the pre-pass to this blocklist for clear.py.
+        @param vocabulary: directory of a persistent vocabulary of the queries, so the query ids stay the
+        same across runs. It is created if it does not exist and saved with the new queries of the input.
+        @param communities: find the communities of the pruned graph with this method of analytics.METHODS and
+        write them to {input}-communities.csv and {input}-nodes.csv. The components are shared among workers.
+        @param k_core: find the communities of the k-core of the pruned graph only.
         """
 
         self.filename = filename
+        self.output_name = inputs.output_name(filename)
         self.window_size = window_size
         self.prune_threshold = prune_threshold
         self.per_ip = per_ip
@@ -181,153 +195,251 @@ class ZarganApp(object):
             self.graph_choice = "y"
         elif generate_graph is False:
             self.graph_choice = "n"
-
+        self.streaming = streaming
+        self.memory_budget = memory_budget
+        self.temp_dir = temp_dir
+        self.workers = workers
+        self.histogram = histogram
+        self.state_file = state_file
+        self.heavy_memory = heavy_memory
+        self.heavy_exact = heavy_exact
+        self.graph_format = graph_format
+        self.top = top
+        self.top_per_term = top_per_term
+        self.related_index = related_index
+        self.metrics_file = metrics_file
+        self.profile_file = profile_file
+        self.compare_chains = compare_chains
+        self.early_rejection = early_rejection or bool(burst_count)
+        self.burst_count = burst_count
+        self.burst_seconds = burst_seconds
+        self.blocklist_file = blocklist_file
+        # IPs rejected by the pre-pass; read_fields skips their lines.
+        self.rejected_ips = {}
+        self.vocabulary = vocabulary
+        self.communities = communities
+        self.k_core = k_core
+        self.metrics = Metrics()
 
     def run(self):
         """Main method of this class."""
-        self.read_input()
-        self.generate_hashmap()
-        self.check_fraud()
-        self.write_hashmap()
-        self.generate_histogram()
-        self.prune_histogram()
-        self.write_text()
+        profiler = None
+        if self.profile_file:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            self.run_stages()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile_file)
+                logger.info("Wrote the profile: {0}".format(self.profile_file))
+
+        for line in self.metrics.summary():
+            logger.info(line)
+        if self.metrics_file:
+            self.metrics.write(self.metrics_file)
+        logger.info("Computation has finished... See the outputs.")
+
+    def run_stages(self):
+        """Runs the stages of run() and measures each of them."""
+        metrics = self.metrics
+        if self.compare_chains and (self.state_file or self.streaming):
+            raise ValueError("The chains can only be compared in the in-memory mode.")
+        if self.early_rejection:
+            with metrics.stage("find_bots"):
+                self.find_bots()
+        if self.state_file:
+            with metrics.stage("ingest"):
+                self.ingest()
+        elif self.streaming:
+            with metrics.stage("stream_histogram"):
+                self.stream_histogram()
+        else:
+            with metrics.stage("read_input") as stage:
+                self.read_input()
+                stage["records"] = len(self.records)
+            with metrics.stage("generate_hashmap") as stage:
+                self.generate_hashmap()
+                stage["ips"] = len(self.hash_map)
+            with metrics.stage("check_fraud"):
+                self.check_fraud()
+            with metrics.stage("write_hashmap"):
+                self.write_hashmap()
+            with metrics.stage("generate_histogram") as stage:
+                self.generate_histogram()
+                stage["records"] = len(self.hash_map.rows)
+                stage["ips"] = len(self.hash_map)
+        with metrics.stage("prune_histogram"):
+            self.prune_histogram()
+        with metrics.stage("write_text"):
+            self.write_text()
+        if self.compare_chains:
+            with metrics.stage("write_comparison"):
+                self.write_comparison()
+        if self.related_index:
+            with metrics.stage("related_index"):
+                related.write_index(self.occurrence_histogram, self.index, self.related_index)
+        if self.communities:
+            with metrics.stage("communities"):
+                self.find_communities()
         if self.graph_choice is None:
             self.graph_choice = raw_input("Do you want to generate graph? [y/n]")
 
         if self.graph_choice == "y":
-            logger.info("Generating graph may take a while...")
-            self.generate_graph()
-            self.write_graph()
+            with metrics.stage("export_graph"):
+                self.export_graph()
         else:
             logger.info("No graphs will be generated.")
 
-        logger.info("Computation has finished... See the outputs.")
-
-    def read_input(self):
-        """Reads from the input file and creates
-        a list of Record objects.
+    def read_fields(self):
+        """Yields the splitted fields of the valid lines in the input file.
+        Stops after item_count lines. The lines of the IPs rejected by find_bots are skipped after they are
+        counted, so the same lines of the input are read with and without the early rejection.
+        """
+        fields = read_fields(self.filename, self.item_count)
+        if not self.rejected_ips:
+            return fields
+        rejected = self.rejected_ips
+        return (cols for cols in fields if cols[1] not in rejected)
+
+    def find_bots(self):
+        """Pre-pass over the input which finds the IPs with more than per_ip searches and, with burst_count,
+        the IPs with more than burst_count searches within burst_seconds. Their lines are skipped by
+        read_fields, so they are never stored. The IPs are added to blocklist_file if it is set.
+        """
+        if inputs.is_directory(self.filename):
+            raise ValueError("Converted inputs are already compact, use them without the early rejection.")
+        logger.info("Finding the fraud IPs...")
+        self.rejected_ips = fraud.find_bots(read_fields(self.filename, self.item_count), self.per_ip,
+                                            self.burst_count, self.burst_seconds)
+        reasons = self.rejected_ips.values()
+        logger.info("Rejected {0} IPs with more than {1} searches and {2} bursting IPs.".format(
+            reasons.count("per_ip"), self.per_ip, reasons.count("burst")))
+        self.metrics.count("rejected_ips", reasons.count("per_ip"))
+        self.metrics.count("burst_ips", reasons.count("burst"))
+        if self.blocklist_file:
+            fraud.write_blocklist(self.rejected_ips, self.blocklist_file)
+
+    def read_input(self, records=None):
+        """Reads from the input file into a columnar RecordStore.
+        Query strings are interned in the store, so the query ids are also the node ids of the histogram.
+        If the input is a directory converted with convert.py, it is memory mapped instead.
+        @param records: RecordStore to add the records to. A new one if None.
         """
         logger.info("Reading from the input file starts...")
 
-        # Create a list for putting the graphs in.
-        self.records = records = []
-        # Open the input file with iso-8859-1 codec.
-        f = codecs.open(self.filename, encoding="utf-8")
-        # Read the first line since it's header.
-        f.readline()
-
-        # For each lines, split the text according to pipes
-        # Create new Record object.
-        i = 0
-        for line in f:
-            fields = line.strip().split("|")
-            if not len(fields) == 12:
-                continue
-            records.append(Record(fields))
-            i += 1
-            if i == self.item_count:
-                break
+        if inputs.is_directory(self.filename):
+            if records is not None:
+                raise ValueError("Converted inputs can not be added to an existing record store.")
+            if self.vocabulary:
+                raise ValueError("Converted inputs keep their own vocabulary, use them without --vocabulary.")
+            self.records = RecordStore.load(self.filename, self.item_count)
+            self.index = self.records.queries
+            return
+
+        self.records = records = RecordStore(queries=self.load_vocabulary()) if records is None else records
+        for fields in self.read_fields():
+            records.append(fields)
+        records.finalize()
+        self.index = records.queries
+        self.save_vocabulary()
+
+    def load_vocabulary(self):
+        """Returns the persistent vocabulary of the queries, or a new one."""
+        if self.vocabulary and Vocabulary.exists(self.vocabulary, "queries"):
+            vocabulary = Vocabulary.load(self.vocabulary, "queries")
+            logger.info("Loaded the vocabulary of {0} queries: {1}".format(len(vocabulary), self.vocabulary))
+            return vocabulary
+        return Vocabulary()
+
+    def save_vocabulary(self):
+        """Saves the vocabulary of the queries if it is persistent."""
+        if self.vocabulary:
+            self.index.save(self.vocabulary, "queries")
+            logger.info("Saved the vocabulary of {0} queries: {1}".format(len(self.index), self.vocabulary))
 
     def generate_hashmap(self):
-        """From the Record list, generates a hashmap in form:
-        IPAddress - [record1, record2, ...]
+        """From the record store, groups the rows in form:
+        IPAddress - [row1, row2, ...]
+        where the rows of each IP are sorted by their dates.
         """
         logger.info("Hash Map generation starts...")
-        # Create a hash map with default value [].
-        self.hash_map = hash_map = collections.defaultdict(list)
-
-        # Sort the records according to their dates.
-        self.records.sort(key=lambda x: x.tarih)
-
-        # For each record, assign the record to its' IP Address block.
-        for record in self.records:
-            hash_map[record.ip].append(record)
+        self.hash_map = self.records.group_by_ip()
 
     def check_fraud(self, top=3):
-        ips = sorted(self.hash_map.keys())
-        #tuples = []
-        remove_candidate = []
-        for ip in ips:
-            count = len(self.hash_map[ip])
-            if count > self.per_ip:
-                remove_candidate.append(ip)
-                #tuples.append((count, ip))
-                #print "{1} - {0}".format(ip, count)
-                #print self.hash_map[ip]
-
-        #tuples.sort(reverse=True)
-        #top_x = tuples[:top]
-        for ip in remove_candidate:
-            del self.hash_map[ip]
+        """Removes the IPs with more than per_ip searches."""
+        count = len(self.hash_map)
+        self.hash_map = self.hash_map.select(self.hash_map.sizes() <= self.per_ip)
+        self.metrics.count("rejected_ips", count - len(self.hash_map))
 
     def write_hashmap(self):
         ho = open("hashmap.txt","w")
-        ips = sorted(self.hash_map.keys())
-        for ip in ips:
-            ho.write("{ip}\t{records}\n".format(ip=ip, records=";".join(map(lambda x: x.arama.encode("utf-8"), self.hash_map[ip]))))
+        store, groups = self.records, self.hash_map
+        # The terms of all of the rows are looked up at once instead of record by record.
+        ips = store.ips.terms_of(groups.ip_ids)
+        queries = store.queries.encoded_terms(store.query_ids[groups.rows])
+        bounds = groups.bounds.tolist()
+        for i in sorted(xrange(len(groups)), key=ips.__getitem__):
+            ho.write("{0}\t{1}\n".format(ips[i].encode("utf-8"), ";".join(queries[bounds[i]:bounds[i + 1]])))
         ho.close()
 
-    def simple_chain(self, ip, clusters):
+    def create_histogram(self):
+        """Returns an empty histogram of the selected backend."""
+        if self.histogram == "heavy":
+            return HeavyHitterHistogram(self.prune_threshold, self.heavy_memory)
+        if self.histogram == "spill":
+            return SpillHistogram(self.prune_threshold, self.memory_budget, self.temp_dir)
+        return HISTOGRAMS[self.histogram]()
+
+    def chain(self, query_ids, starts, ends):
+        """Adds the edges of the clusters with the selected chaining method."""
+        if self.use_complete_chain:
+            self.complete_chain(query_ids, starts, ends)
+        else:
+            self.simple_chain(query_ids, starts, ends)
+
+    def simple_chain(self, query_ids, starts, ends):
         """
         Connects each two adjacent words in each cluster.
-        @param clusters: cluster list with words in them.
-        @return: nothing. modifies index and occurrence_histogram.
+        @param query_ids: numpy array of the query ids of the date sorted searches.
+        @param starts, ends: the i'th cluster is query_ids[starts[i]:ends[i]].
+        @return: nothing. modifies occurrence_histogram.
         """
-        hist = self.occurrence_histogram
-        index = self.index
-
-        for cluster_ in clusters:
-            cluster_size = len(cluster_)
-            if cluster_size > self.per_sesssion:
-                print("Suspicious IP: {ip}, one cluster: {c}".format(ip=ip, c=cluster_size))
-                continue
-
-            for i in xrange(len(cluster_)-1):
-                current = cluster_[i]
-                next = cluster_[i+1]
-
-                # link each two adjacent words.
-                u = current[1].arama
-                v = next[1].arama
-
-                if u == v:
-                    continue
-
-                u_id = index.get_index_of(u)
-                v_id = index.get_index_of(v)
-                if (u_id, v_id) in hist:
-                    hist[(u_id, v_id)] += 1
-                else:
-                    hist[(v_id, u_id)] += 1
-
-    def complete_chain(self, ip, clusters):
+        # link each two adjacent words.
+        firsts = ranges(starts, ends - 1)
+        u_ids = query_ids[firsts]
+        v_ids = query_ids[firsts + 1]
+        different = u_ids != v_ids
+        self.occurrence_histogram.add_pairs(u_ids[different], v_ids[different])
+
+    def complete_chain(self, query_ids, starts, ends, simple_histogram=None):
         """
         For each cluster,
             Connects each word in a cluster.
-        @param clusters: cluster list with words in them.
-        @return: nothing. modifies index and occurrence_histogram.
+        @param query_ids: numpy array of the query ids of the date sorted searches.
+        @param starts, ends: the i'th cluster is query_ids[starts[i]:ends[i]].
+        @param simple_histogram: also add the edges of simple_chain to this histogram, in the same order.
+        @return: nothing. modifies occurrence_histogram.
         """
         hist = self.occurrence_histogram
-        index = self.index
-
-        for cluster_ in clusters:
-            cluster_size = len(cluster_)
-            if cluster_size > self.per_sesssion:
-                print("Suspicious IP: {ip}, one cluster: {c}".format(ip=ip, c=cluster_size))
-                continue
-            combinations = itertools.combinations(cluster_, 2)
-            for combination in combinations:
-                u = combination[0][1].arama
-                v = combination[1][1].arama
-                if u == v:
-                    continue
-                u_id = index.get_index_of(u)
-                v_id = index.get_index_of(v)
-                if (u_id, v_id) in hist:
-                    hist[(u_id, v_id)] += 1
-                else:
-                    hist[(v_id, u_id)] += 1
+        lengths = ends - starts
+        pair_counts = np.cumsum(lengths * (lengths - 1) // 2)
+        # Consecutive sessions with about BUFFER_SIZE pairs are added at once.
+        first = 0
+        while first < len(starts):
+            done = pair_counts[first - 1] if first else 0
+            last = max(first + 1, np.searchsorted(pair_counts, done + BUFFER_SIZE, side="right"))
+            firsts, seconds = session_pairs(starts[first:last], ends[first:last])
+            u_ids = query_ids[firsts]
+            v_ids = query_ids[seconds]
+            different = u_ids != v_ids
+            hist.add_pairs(u_ids[different], v_ids[different])
+            if simple_histogram is not None:
+                # The pairs of adjacent searches are the edges of simple_chain.
+                adjacent = different & (seconds == firsts + 1)
+                simple_histogram.add_pairs(u_ids[adjacent], v_ids[adjacent])
+            first = last
 
     def generate_histogram(self):
         """Generates a histogram according to co-session.
@@ -338,66 +450,316 @@ class ZarganApp(object):
         Prune the histogram according to occurence frequencies so that noise can be eliminated.
         """
         logger.info("Histogram construction starts...")
-        del self.records
-        self.occurrence_histogram = hist = collections.defaultdict(int)
+        # Now we need to detect the sessions of all IPs at once.
+        store = self.records
+        groups = self.hash_map
+        query_ids = store.query_ids[groups.rows]
+        starts, ends = self.find_sessions(store.secs[groups.rows], groups=groups)
+        if self.compare_chains:
+            self.compare_chain(query_ids, starts, ends)
+        elif self.workers > 1:
+            self.generate_histogram_parallel(query_ids, starts, ends)
+        else:
+            self.occurrence_histogram = hist = self.create_histogram()
+            self.chain(query_ids, starts, ends)
+            logger.debug("{0} IPs, {1} sessions - {2} MB histogram, {3} MB resident".format(
+                len(groups), len(starts), hist.memory_size()/1024.0/1024.0, rss()))
+        if self.histogram == "heavy":
+            self.check_heavy_hitters(query_ids, starts, ends)
+
+    def compare_chain(self, query_ids, starts, ends):
+        """Builds the histograms of both chaining methods in one pass over the sessions, see compare_chains.
+        The histogram of the other method is kept in compared_histogram.
+        """
+        if self.histogram == "heavy":
+            raise ValueError("The chain comparison needs the exact edge counts, use another histogram.")
+        if self.workers > 1:
+            logger.info("The chains are compared in a single process.")
+        complete, simple = self.create_histogram(), self.create_histogram()
+        self.occurrence_histogram = complete
+        self.complete_chain(query_ids, starts, ends, simple)
+        if self.use_complete_chain:
+            self.compared_histogram = simple
+        else:
+            self.occurrence_histogram, self.compared_histogram = simple, complete
+
+    def write_comparison(self):
+        """Writes the edges of both chaining methods to compare-chain-intersection.txt, the edges of only
+        complete_chain to compare-chain-c-s.txt and the edges of only simple_chain to compare-chain-s-c.txt,
+        in the directory of the input file.
+        """
+        if self.use_complete_chain:
+            complete, simple = self.occurrence_histogram, self.compared_histogram
+        else:
+            complete, simple = self.compared_histogram, self.occurrence_histogram
+        complete_keys, simple_keys = export.edge_keys(complete), export.edge_keys(simple)
+        directory = os.path.dirname(self.output_name.rstrip(os.sep))
+        for name, keys in (("intersection", np.intersect1d(complete_keys, simple_keys, assume_unique=True)),
+                           ("c-s", np.setdiff1d(complete_keys, simple_keys, assume_unique=True)),
+                           ("s-c", np.setdiff1d(simple_keys, complete_keys, assume_unique=True))):
+            logger.info("{0}: {1}".format(name, len(keys)))
+            self.metrics.count("compare_" + name.replace("-", "_"), len(keys))
+            export.write_edge_set(keys, self.index, os.path.join(directory, "compare-chain-{0}.txt".format(name)))
+
+    def check_heavy_hitters(self, query_ids=None, starts=None, ends=None):
+        """Logs the error bound of the heavy histogram. With heavy_exact, the sessions are chained
+        once more to replace the estimates of the candidates with their exact weights.
+        """
+        hist = self.occurrence_histogram
+        overestimate, probability, missed = hist.error_bound()
+        logger.info("{0} candidate edges; estimates exceed the weights by at most {1:.1f} with probability {2:.3f}".format(
+            len(hist), overestimate, probability))
+        if missed:
+            logger.warning("The candidate set was full, edges with weight <= {0} may be missing. "
+                           "Increase the memory of the heavy histogram.".format(missed))
+        if not self.heavy_exact:
+            return
+        if query_ids is None:
+            logger.warning("The exact pass is not available in the streaming mode, the weights are estimates.")
+            return
+        logger.info("Counting the exact weights of the candidates...")
+        hist.exact_pass()
+        self.chain(query_ids, starts, ends)
+
+    def find_sessions(self, dates, groups=None, ip=None):
+        """Clusters the searches into sessions and drops the sessions with a single search
+        and the suspicious ones with more than per_session searches.
+        @param dates: dates of the searches, see cluster().
+        @param groups: IPGroups the dates belong to, or None if they belong to a single ip.
+        @return: (starts, ends) arrays of the remaining sessions.
+        """
+        bounds = cluster(dates, self.window_size, None if groups is None else groups.bounds)
+        return self.filter_sessions(bounds[:-1], bounds[1:], groups, ip)
+
+    def filter_sessions(self, starts, ends, groups=None, ip=None):
+        """Drops the sessions with a single search and the suspicious ones, see find_sessions."""
+        sizes = ends - starts
+        suspicious = sizes > self.per_sesssion
+        self.metrics.count("suspicious_sessions", suspicious.sum())
+        for start, size in itertools.izip(starts[suspicious].tolist(), sizes[suspicious].tolist()):
+            if groups is not None:
+                ip = groups.ip_of(np.searchsorted(groups.bounds, start, side="right") - 1)
+            print("Suspicious IP: {ip}, one cluster: {c}".format(ip=ip, c=size))
+        keep = (sizes > 1) & ~suspicious
+        return starts[keep], ends[keep]
+
+    def generate_histogram_parallel(self, query_ids, starts, ends):
+        """Builds the histogram with a pool of worker processes.
+
+        IPs are sharded among the workers by the hash of the address. Each worker builds a partial
+        histogram and reports when each edge was first seen. The partials are merged in that order,
+        so the edge directions are the same as the serial run.
+        """
+        logger.info("Building the histogram with {0} workers...".format(self.workers))
+        # Only the parameters are sent to the workers, not the data of this instance.
+        # An edge with weight >= prune_threshold has at least prune_threshold / workers in one of the shards.
+        # The memory of the heavy and spill histograms is shared by the workers.
+        heavy_memory = max(1, self.heavy_memory // self.workers)
+        params = dict(window_size=self.window_size, per_session=self.per_sesssion,
+                      complete_chain=self.use_complete_chain, histogram=self.histogram,
+                      prune_threshold=-(-self.prune_threshold // self.workers), heavy_memory=heavy_memory,
+                      memory_budget=max(1, self.memory_budget // self.workers), temp_dir=self.temp_dir)
+        groups = self.hash_map
+        ip_shards = np.array([(zlib.crc32(groups.ip_of(i)) & 0xffffffff) % self.workers
+                              for i in xrange(len(groups))], dtype=np.int64)
+        owners = np.searchsorted(groups.bounds, starts, side="right") - 1
+        shards = []
+        for shard in xrange(self.workers):
+            selected = ip_shards[owners] == shard
+            # Send only the searches in the sessions of the shard.
+            lengths = ends[selected] - starts[selected]
+            shard_ends = np.cumsum(lengths)
+            shards.append((params, query_ids[ranges(starts[selected], ends[selected])],
+                           shard_ends - lengths, shard_ends, owners[selected]))
+
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            partials = pool.map(build_shard_histogram, shards)
+        finally:
+            pool.terminate()
+        if self.histogram == "heavy":
+            # The sketches of the workers are summed, so the merged one has their size.
+            hist = HeavyHitterHistogram(self.prune_threshold, heavy_memory)
+        else:
+            hist = self.create_histogram()
+        self.occurrence_histogram = hist = hist.merge(partials)
+        logger.info("Merged {0} partial histograms: {1} edges.".format(len(partials), len(hist)))
+
+    def ingest(self):
+        """Incremental alternative of generate_histogram for daily files.
+
+        Continues from the state saved in state_file: the vocabulary, the edge counts of the closed
+        sessions and the searches of the sessions still open at the end of the previous file. Open
+        sessions are merged with the searches of the input file, so a session crossing the file boundary
+        gives the same edges as one combined run. The resulting histogram is the one of all of the files
+        ingested so far; per_ip is checked for each file separately.
+        """
+        if self.histogram == "heavy":
+            raise ValueError("The incremental mode needs the exact edge counts, use another histogram.")
+        if self.histogram == "spill":
+            raise ValueError("The incremental state keeps all of the edges in memory, use another histogram.")
+        if self.vocabulary:
+            raise ValueError("The incremental state keeps its own vocabulary, use it without --vocabulary.")
+        params = (self.window_size, self.per_sesssion, self.use_complete_chain, self.histogram)
+        state = IngestState.load(self.state_file, params)
+        names = [os.path.basename(filename) for filename in inputs.expand(self.filename)]
+        for name in names:
+            if name in state.files:
+                raise ValueError("{0} has already been ingested into {1}".format(name, self.state_file))
+
+        # The open sessions of the previous files come before the new searches.
+        store = RecordStore(queries=state.index)
+        for ip, (dates, query_ids) in state.sessions.iteritems():
+            for date, query_id in itertools.izip(dates, query_ids):
+                store.append_parsed(ip, query_id, date)
+        self.read_input(store)
+        self.generate_hashmap()
+        self.check_fraud()
+        self.write_hashmap()
+
+        logger.info("Histogram construction starts...")
+        groups = self.hash_map
+        dates = store.secs[groups.rows]
+        query_ids = store.query_ids[groups.rows]
+        bounds = cluster(dates, self.window_size, groups.bounds)
+        starts, ends = bounds[:-1], bounds[1:]
+
+        # The last session of an IP stays open if a search in the next file can still join it.
+        # Without any searches so far there is no last date, and no session to keep open.
+        last_date = state.last_date
+        is_open = np.zeros(len(starts), dtype=bool)
+        if len(dates):
+            last_date = max(last_date, dates.max())
+            last_sessions = np.searchsorted(ends, groups.bounds[1:])
+            is_open[last_sessions] = dates[ends[last_sessions] - 1] >= last_date - self.window_size
+
+        self.occurrence_histogram = hist = HISTOGRAMS[self.histogram].from_arrays(*state.edges)
+        self.chain(query_ids, *self.filter_sessions(starts[~is_open], ends[~is_open], groups))
+
+        state.edges = hist.arrays()
+        state.sessions = {}
+        for i in np.flatnonzero(is_open).tolist():
+            ip = groups.ip_of(np.searchsorted(groups.bounds, starts[i], side="right") - 1)
+            state.sessions[ip] = (dates[starts[i]:ends[i]].tolist(), query_ids[starts[i]:ends[i]].tolist())
+        state.last_date = last_date
+        state.files.extend(names)
+        state.save(self.state_file)
+
+        # The output also contains the open sessions, as if the input ended here.
+        self.chain(query_ids, *self.filter_sessions(starts[is_open], ends[is_open], groups))
+
+    def stream_histogram(self):
+        """Bounded-memory alternative of read_input, generate_hashmap, check_fraud,
+        write_hashmap and generate_histogram.
+
+        Records are sorted by (IP, date) with an external sort that spills to temporary files
+        once memory_budget is exceeded. The sorted stream is consumed one IP at a time, so only
+        the searches of the current IP are kept as Record objects. The histogram is the same as
+        the in-memory mode, but the IPs are visited in sorted order.
+        """
+        logger.info("Streaming histogram construction starts...")
+        if inputs.is_directory(self.filename):
+            raise ValueError("Converted inputs are already compact, use them without the streaming mode.")
+        sorter = ExternalSorter(memory_budget=self.memory_budget, temp_dir=self.temp_dir)
+        # Sequence number keeps the records with the same date in the file order, like the stable sort.
+        for seq, fields in enumerate(self.read_fields()):
+            sorter.add((fields[1], fields[2].split(".")[0], seq, fields[0]))
 
-        # Now we need to detect the sessions.
-        # for each ip, search_list pair,
+        logger.info("Histogram construction starts...")
+        self.occurrence_histogram = hist = self.create_histogram()
+        self.index = index = self.load_vocabulary()
+        ho = open("hashmap.txt", "w")
         ips = 0
-        self.index = index = Index()
-        for ip, searches in self.hash_map.iteritems():
+        for ip, items in itertools.groupby(sorter, key=operator.itemgetter(0)):
+            searches = []
+            for item in items:
+                # Fraud IPs are still consumed but not kept in memory.
+                if len(searches) <= self.per_ip:
+                    searches.append(Record((item[3], ip, item[1])))
+            if len(searches) > self.per_ip:
+                self.metrics.count("rejected_ips", 1)
+                continue
+            write_searches(ho, ip, searches)
             ips += 1
-            # get the first one.
-            min_date = searches[0].get_date_in_secs()
-            # get all of them and subtract the first one, making the first record 0 always. (for performance)
-            dates = [(search.get_date_in_secs() - min_date, search) for search in searches]
-            if len(dates) > 1:
-                clusters = cluster(data=dates, window_size=self.window_size)
-                if self.use_complete_chain:
-                    self.complete_chain(ip, clusters)
-                else:
-                    self.simple_chain(ip, clusters)
+            query_ids = index.get_indexes_of([search.arama for search in searches])
+            starts, ends = self.find_sessions(np.array([search.get_date_in_secs() for search in searches]), ip=ip)
+            self.chain(query_ids, starts, ends)
 
             if ips % 50000 == 0:
-                logger.debug("{0} IPs - {1} MB".format(ips, sys.getsizeof(hist)/1024.0/1024.0))
+                logger.debug("{0} IPs - {1} MB histogram, {2} MB resident".format(
+                    ips, hist.memory_size()/1024.0/1024.0, rss()))
+        ho.close()
+        self.save_vocabulary()
+        if self.histogram == "heavy":
+            self.check_heavy_hitters()
 
     def prune_histogram(self):
         logger.info("Pruning the edges with weight < {0}".format(self.prune_threshold))
-        hist = self.occurrence_histogram
-        delete_list = collections.deque()
-        for (key, value) in hist.iteritems():
-            if value < self.prune_threshold:
-                delete_list.append(key)
-        for item in delete_list:
-            del hist[item]
+        count = len(self.occurrence_histogram)
+        if self.histogram == "spill":
+            # The spill histogram is pruned while its partitions are reduced.
+            count += self.occurrence_histogram.pruned
+            logger.info("Reduced {0} spills of the edges.".format(self.occurrence_histogram.spills))
+        self.occurrence_histogram.prune(self.prune_threshold)
+        if self.compare_chains:
+            self.compared_histogram.prune(self.prune_threshold)
+        self.metrics.count("pruned_edges", count - len(self.occurrence_histogram))
+        self.metrics.count("edges", len(self.occurrence_histogram))
 
         logger.info("Pruning finished...")
 
-    def write_text(self):
+    def sweep(self, windows, thresholds, write_outputs=False):
+        """Runs the pipeline once for several window sizes and prune thresholds, see sweep.py.
+        Writes a summary table of the nodes and edges of each combination to {input}-sweep.csv.
+        The IPs rejected by early_rejection and burst_count are skipped as in run().
+        """
+        if self.early_rejection:
+            self.find_bots()
+        self.read_input()
+        self.generate_hashmap()
+        self.check_fraud()
+        logger.info("Sweeping {0} windows and {1} thresholds...".format(len(windows), len(thresholds)))
+        summary = sweep.sweep(self, windows, thresholds, write_outputs)
+        sweep.write_summary(summary, "{0}-sweep.csv".format(".".join(self.output_name.rstrip(os.sep).split(".")[:-1])))
+        return summary
+
+    def write_text(self, filename=None):
+        """Writes the edges sorted by weight to {input}-output.csv, or to filename if given.
+        Only the heaviest edges are written if top or top_per_term is set, see export.write_csv.
+        """
         logger.info("Writing the edges to a text file...")
-        hist = self.occurrence_histogram
-        #items = ["{0} - {1} : {2}".format(edge[0].encode("latin5"), edge[1].encode("latin5"), hist[edge]) for edge in
-                 #sorted(hist.keys())]
-        gt = lambda id: self.index.get_value_of(id).encode("utf-8")
-
-
-        records = [(hist[edge], gt(edge[0]), gt(edge[1])) for edge in hist.keys()]
-        records.sort(key=lambda x: (-x[0], x[1], x[2]))
-
-        items = ["{0}; {1}; {2}".format(*record) for record in records]
-        filename = "{0}-output.csv".format(".".join(self.filename.split(".")[:-1]))
-        o = open(filename, "w")
-        o.write("\n".join(items))
-        o.close()
+        if filename is None:
+            filename = "{0}-output.csv".format(".".join(self.output_name.split(".")[:-1]))
+        export.write_csv(self.occurrence_histogram, self.index, filename, self.top, self.top_per_term,
+                         self.memory_budget, self.temp_dir)
 
         logger.info("Writing finished: {0}".format(filename))
 
+    def find_communities(self):
+        """Finds the communities of the pruned histogram and writes them next to the input, see analytics.py."""
+        logger.info("Finding the communities...")
+        graph = analytics.CSRGraph.from_histogram(self.occurrence_histogram)
+        base = ".".join(self.output_name.split(".")[:-1])
+        stats, labels = analytics.analyze(graph, self.index.encoded_terms(graph.nodes), base, self.communities,
+                                          self.k_core, self.workers)
+        self.metrics.count("components", stats["components"])
+        self.metrics.count("communities", stats["communities"])
+
+    def export_graph(self):
+        """Writes the pruned histogram to {input}.graphml, .gexf or .zedges (see graph_format) directly,
+        without building the networkx graph of generate_graph.
+        """
+        filename = "{0}.{1}".format(self.output_name, export.EXTENSIONS[self.graph_format])
+        export.write_graph(self.occurrence_histogram, self.index, filename, self.graph_format)
+
     def generate_graph(self):
         # Create the nodes from the record objects.
         self.graph = graph = OccurrenceGraph()
-        gt = lambda id: self.index.get_value_of(id)
+        u_ids, v_ids, weights = self.occurrence_histogram.arrays()
+        nodes = np.unique(np.concatenate((u_ids, v_ids)))
+        terms = dict(itertools.izip(nodes.tolist(), self.index.terms_of(nodes)))
         for key, value in self.occurrence_histogram.iteritems():
-            graph.add_edge(gt(key[0]), gt(key[1]), weight=value)
+            graph.add_edge(terms[key[0]], terms[key[1]], weight=value)
         logger.info("Generation of the graph has finished.")
 
     def write_graph(self):
@@ -406,26 +768,120 @@ class ZarganApp(object):
         """
         """if self.graph.number_of_nodes() < 100:
             self.graph.draw()"""
-        graph_filename = "{0}.graphml".format(self.filename)
+        graph_filename = "{0}.graphml".format(self.output_name)
         self.graph.write_graphml(graph_filename)
         logger.info("Wrote the graph: {0}".format(graph_filename))
 
 
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Finds the co-searched terms in the Zargan search logs.")
+    parser.add_argument("filename", nargs="?", default="zargan/data/filtered.txt",
+                        help="input file or a quoted glob pattern; .gz, .bz2 and .xz files are decompressed")
+    parser.add_argument("item_count", nargs="?", type=float, default=2400000,
+                        help="number of lines read from the input file")
+    parser.add_argument("window_size", nargs="?", type=float, default=300.0, help="window size in seconds")
+    parser.add_argument("prune_threshold", nargs="?", type=int, default=20,
+                        help="edges with weight < threshold will be removed")
+    parser.add_argument("--stream", action="store_true",
+                        help="group the records with an external sort instead of keeping them in memory")
+    parser.add_argument("--memory-budget", type=int, default=256,
+                        help="memory (MB) used for buffering records in the streaming mode, for the edges of "
+                             "--histogram spill and for sorting the output")
+    parser.add_argument("--temp-dir", default=None,
+                        help="directory for the spill files of the streaming mode, --histogram spill and the output sort")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes that build the histogram (not used by --stream)")
+    parser.add_argument("--state", default=None,
+                        help="incremental mode: add the input file to the histogram state saved in this file")
+    parser.add_argument("--histogram", choices=sorted(HISTOGRAMS), default="packed",
+                        help="histogram backend: packed int64 arrays, the original dict of tuples, the "
+                             "approximate heavy hitters that may reach prune_threshold or the exact "
+                             "out-of-core histogram spilled to --temp-dir")
+    parser.add_argument("--heavy-memory", type=int, default=64,
+                        help="memory (MB) of the heavy histogram, shared by the --workers; the error bound is logged")
+    parser.add_argument("--heavy-exact", action="store_true",
+                        help="count the exact weights of the heavy histogram candidates with a second pass")
+    parser.add_argument("--graph-format", choices=sorted(export.WRITERS), default="graphml",
+                        help="format of the graph file: GraphML, GEXF or the binary edge list (.zedges)")
+    parser.add_argument("--top", type=int, default=None, help="write only the N heaviest edges to the output")
+    parser.add_argument("--top-per-term", type=int, default=None,
+                        help="write only the edges which are among the K heaviest edges of one of their terms")
+    parser.add_argument("--related-index", default=None,
+                        help="directory to write the related terms index to, see zargan/related.py")
+    parser.add_argument("--metrics", default=None,
+                        help="write the time, memory and counters of each stage to this JSON file")
+    parser.add_argument("--profile", default=None, help="write a cProfile dump of the run to this file")
+    parser.add_argument("--compare-chains", action="store_true",
+                        help="build the simple and complete chain histograms in one pass and write the "
+                             "compare-chain-*.txt files of their shared and different edges")
+    parser.add_argument("--early-rejection", action="store_true",
+                        help="find the IPs with more than per_ip searches in a pre-pass and skip their lines; "
+                             "the skipped lines count towards item_count")
+    parser.add_argument("--burst-count", type=int, default=None,
+                        help="also reject the IPs with more than N searches within --burst-seconds")
+    parser.add_argument("--burst-seconds", type=float, default=60.0)
+    parser.add_argument("--blocklist", default=None,
+                        help="add the rejected IPs to this file, which clear.py --blocklist can read")
+    parser.add_argument("--vocabulary", default=None,
+                        help="directory of a persistent vocabulary, so the query ids stay the same across runs "
+                             "(not with --state or a converted input, which keep their own)")
+    parser.add_argument("--communities", choices=sorted(analytics.METHODS), default=None,
+                        help="find the communities of the pruned graph with Louvain or label propagation and "
+                             "write them to {input}-communities.csv and {input}-nodes.csv")
+    parser.add_argument("--k-core", type=int, default=None,
+                        help="find the communities of the k-core of the pruned graph only")
+    parser.add_argument("--sweep-windows", type=lambda x: map(float, x.split(",")), default=None,
+                        help="comma separated window sizes to sweep in one pass, e.g. 60,120,300")
+    parser.add_argument("--sweep-thresholds", type=lambda x: map(int, x.split(",")), default=None,
+                        help="comma separated prune thresholds of the sweep (default: prune_threshold)")
+    parser.add_argument("--sweep-outputs", action="store_true",
+                        help="also write the pruned output of each sweep combination")
+    options = parser.parse_args(args)
+    if options.sweep_windows or options.sweep_thresholds:
+        # The sweep reads the input into memory once and counts the edges in packed arrays itself.
+        ignored = [flag for flag, used in (("--stream", options.stream), ("--state", options.state),
+                                           ("--histogram", options.histogram != "packed"),
+                                           ("--workers", options.workers != 1),
+                                           ("--heavy-exact", options.heavy_exact),
+                                           ("--compare-chains", options.compare_chains),
+                                           ("--related-index", options.related_index),
+                                           ("--communities", options.communities),
+                                           ("--k-core", options.k_core)) if used]
+        if ignored:
+            parser.error("{0} can not be used with --sweep-windows or --sweep-thresholds".format(", ".join(ignored)))
+    # Converted inputs and the incremental state have their own vocabularies.
+    if options.vocabulary and options.state:
+        parser.error("--vocabulary can not be used with --state")
+    if options.vocabulary and inputs.is_directory(options.filename):
+        parser.error("--vocabulary can not be used with a converted input")
+    return options
+
+
 if __name__ == "__main__":
+    # Get the command line parameters.
+    options = parse_args()
     try:
-        # Get the command line parameters.
-        filename = sys.argv[1]
-        item_count = float(sys.argv[2])
-        window_size = float(sys.argv[3])
-        prune_threshold = int(sys.argv[4])
         # Run the ZarganApp with the parameters.
-        params = (filename, item_count, window_size, prune_threshold)
-        app = ZarganApp(*params)
-        app.run()
+        app = ZarganApp(options.filename, options.item_count, options.window_size, options.prune_threshold,
+                        streaming=options.stream, memory_budget=options.memory_budget, temp_dir=options.temp_dir,
+                        workers=options.workers, histogram=options.histogram, state_file=options.state,
+                        heavy_memory=options.heavy_memory, heavy_exact=options.heavy_exact,
+                        graph_format=options.graph_format, top=options.top, top_per_term=options.top_per_term,
+                        related_index=options.related_index, metrics_file=options.metrics,
+                        profile_file=options.profile, compare_chains=options.compare_chains,
+                        early_rejection=options.early_rejection, burst_count=options.burst_count,
+                        burst_seconds=options.burst_seconds, blocklist_file=options.blocklist,
+                        vocabulary=options.vocabulary, communities=options.communities,
+                        k_core=options.k_core)
+        if options.sweep_windows or options.sweep_thresholds:
+            app.sweep(options.sweep_windows or [options.window_size],
+                      options.sweep_thresholds or [options.prune_threshold], options.sweep_outputs)
+        else:
+            app.run()
 
-    except (IndexError, IOError) as e:
+    except IOError as e:
         logger.error(e)
-        # If no parameters specified, run with the defaults.
+        # If the input can not be read, run with the defaults.
         logger.warning("Running with default settings...")
         app = ZarganApp()
         app.run()
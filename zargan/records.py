@@ -0,0 +1,197 @@
+"""Compact, columnar storage of the search records.
+
+Each search is stored as three integers in typed arrays: the id of the query, the id of the IP
+address and the date in epoch seconds. Query and IP strings are interned in a Vocabulary in batches,
+so every distinct string is kept only once. Record objects are only created as views of single rows.
+
+A store can be saved into a directory of .npy files (see convert.py) and loaded back memory mapped,
+so the text input is parsed only once.
+"""
+import os
+import time
+from array import array
+
+import numpy as np
+
+from dates import date_to_secs, parse_dates
+from inputs import read_lines
+from vocabulary import Vocabulary
+
+# Number of searches collected before their dates are parsed and their strings interned together.
+DATE_BATCH = 65536
+
+
+def read_fields(filename, item_count=None):
+    """Yields the splitted fields of the valid lines in the input files, see inputs.py.
+    Stops after item_count lines.
+    """
+    # For each lines, split the text according to pipes
+    i = 0
+    for line in read_lines(filename, encoding="utf-8"):
+        fields = line.strip().split("|")
+        if not len(fields) == 12:
+            continue
+        yield fields
+        i += 1
+        if i == item_count:
+            break
+
+
+class Record(object):
+    """Lightweight view of a search. Used for debugging and writing the hash map."""
+    __slots__ = ("arama", "ip", "tarih", "secs")
+
+    def __init__(self, fields):
+        self.arama = fields[0].lower()
+        self.ip = fields[1]
+        self.tarih = fields[2].split(".")[0]
+        self.secs = None
+
+    @classmethod
+    def from_store(cls, store, row):
+        secs = int(store.secs[row])
+        record = cls((store.queries.get_value_of(int(store.query_ids[row])),
+                      store.ips.get_value_of(int(store.ip_ids[row])),
+                      time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(secs))))
+        record.secs = secs
+        return record
+
+    def __str__(self):
+        return ("Tarih: %-29s\t IP: %s\t arama: %s\t" % (self.tarih, self.ip, self.arama)).encode("utf8")
+
+    def __repr__(self):
+        return self.arama.encode("utf8")
+
+    def get_date_in_secs(self):
+        """
+        Returns the date of the record in seconds.
+        """
+        if self.secs is None:
+            self.secs = date_to_secs(self.tarih)
+        return self.secs
+
+
+class RecordStore(object):
+    def __init__(self, queries=None):
+        """Columnar record store. Rows are appended while reading the input; after finalize()
+        query_ids, ip_ids and secs are numpy arrays of the same length.
+        @param queries: Vocabulary to intern the queries in. A new one if None.
+        """
+        self.queries = Vocabulary() if queries is None else queries
+        self.ips = Vocabulary()
+        self.query_ids = array("i")
+        self.ip_ids = array("i")
+        self.secs = array("l")
+        # Fields of the searches waiting to be added in a batch.
+        self.pending_queries = []
+        self.pending_ips = []
+        self.dates = []
+
+    def __len__(self):
+        return len(self.query_ids) + len(self.dates)
+
+    def append(self, fields):
+        """Adds the splitted fields of a line to the store."""
+        self.pending_queries.append(fields[0].lower())
+        self.pending_ips.append(fields[1])
+        self.dates.append(fields[2])
+        if len(self.dates) == DATE_BATCH:
+            self.flush()
+
+    def append_parsed(self, ip, query_id, secs):
+        """Adds a search with an interned query and a parsed date."""
+        # Keep the searches that wait for the batch in order.
+        if self.dates:
+            self.flush()
+        self.query_ids.append(query_id)
+        self.ip_ids.append(self.ips.get_index_of(ip))
+        self.secs.append(secs)
+
+    def flush(self):
+        """Interns the collected queries and IPs and converts the collected dates into seconds."""
+        self.query_ids.fromstring(self.queries.get_indexes_of(self.pending_queries).astype(np.intc).tostring())
+        self.ip_ids.fromstring(self.ips.get_indexes_of(self.pending_ips).astype(np.intc).tostring())
+        self.secs.fromstring(parse_dates(self.dates).astype(np.int_).tostring())
+        self.pending_queries = []
+        self.pending_ips = []
+        self.dates = []
+
+    def finalize(self):
+        """Converts the growable arrays into numpy arrays without copying."""
+        self.flush()
+        self.query_ids = np.frombuffer(self.query_ids, dtype=np.intc)
+        self.ip_ids = np.frombuffer(self.ip_ids, dtype=np.intc)
+        # array has no 64 bit type code, "l" is as wide as a C long.
+        self.secs = np.frombuffer(self.secs, dtype=np.int_).astype(np.int64, copy=False)
+
+    def record(self, row):
+        return Record.from_store(self, row)
+
+    def save(self, path):
+        """Saves the finalized store into the directory path."""
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.queries.save(path, "queries")
+        self.ips.save(path, "ips")
+        np.save(os.path.join(path, "query_ids.npy"), self.query_ids)
+        np.save(os.path.join(path, "ip_ids.npy"), self.ip_ids)
+        np.save(os.path.join(path, "secs.npy"), self.secs)
+
+    @classmethod
+    def load(cls, path, item_count=None):
+        """Memory maps a store saved with save(). Only the first item_count records are used."""
+        store = cls(queries=Vocabulary.load(path, "queries"))
+        store.ips = Vocabulary.load(path, "ips")
+        count = None if item_count is None else int(item_count)
+        store.query_ids = np.load(os.path.join(path, "query_ids.npy"), mmap_mode="r")[:count]
+        store.ip_ids = np.load(os.path.join(path, "ip_ids.npy"), mmap_mode="r")[:count]
+        store.secs = np.load(os.path.join(path, "secs.npy"), mmap_mode="r")[:count]
+        return store
+
+    def group_by_ip(self):
+        """Groups the rows by IP, ordering the rows of each IP by date.
+        Records with the same date keep their input order.
+        """
+        if not len(self):
+            return IPGroups(self, self.ip_ids[:0], np.arange(0), np.zeros(1, dtype=np.int64))
+        # lexsort is stable and sorts by the last key first.
+        rows = np.lexsort((self.secs, self.ip_ids))
+        ip_ids = self.ip_ids[rows]
+        starts = np.flatnonzero(np.diff(ip_ids)) + 1
+        bounds = np.concatenate(([0], starts, [len(rows)]))
+        return IPGroups(self, ip_ids[bounds[:-1]], rows, bounds)
+
+
+class IPGroups(object):
+    def __init__(self, store, ip_ids, rows, bounds):
+        """Rows of a RecordStore grouped by IP address.
+        The rows of the i'th IP are rows[bounds[i]:bounds[i + 1]].
+        """
+        self.store = store
+        self.ip_ids = ip_ids
+        self.rows = rows
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.ip_ids)
+
+    def sizes(self):
+        return np.diff(self.bounds)
+
+    def select(self, mask):
+        """Returns the groups for which mask is True."""
+        sizes = self.sizes()
+        rows = self.rows[np.repeat(mask, sizes)]
+        bounds = np.concatenate(([0], np.cumsum(sizes[mask])))
+        return IPGroups(self.store, self.ip_ids[mask], rows, bounds)
+
+    def ip_of(self, i):
+        return self.store.ips.get_value_of(int(self.ip_ids[i]))
+
+    def rows_of(self, i):
+        return self.rows[self.bounds[i]:self.bounds[i + 1]]
+
+    def __iter__(self):
+        """Yields (ip, rows) pairs."""
+        for i in xrange(len(self.ip_ids)):
+            yield self.ip_of(i), self.rows_of(i)
@@ -0,0 +1,160 @@
+"""Memory mapped index of the related terms of the pruned histogram.
+
+An index is a directory of .npy files:
+
+    terms.npy, terms.offsets.npy: utf-8 encoded terms in sorted order, see vocabulary.Vocabulary
+    slots.npy: open addressing hash table of the term positions (crc32, linear probing), -1 if empty
+    indptr.npy, neighbors.npy, weights.npy: CSR adjacency; the neighbors of the i'th term are
+        neighbors[indptr[i]:indptr[i + 1]], sorted by decreasing weight and then by term
+
+The files are opened memory mapped, so an index loads instantly and the processes reading the same
+index share its pages. Build it with process.py --related-index, or from a binary edge list:
+
+    python zargan/related.py build zargan/data/filtered.txt.zedges zargan/data/related
+    python zargan/related.py lookup zargan/data/related sozluk -k 10
+"""
+import os
+import sys
+import logging
+import argparse
+
+import numpy as np
+
+from export import read_edges, term_ranks
+from vocabulary import term_hash
+
+logger = logging.getLogger("ZarganApp")
+
+
+def build_index(path, terms, sources, targets, weights):
+    """Writes the index of the edges sources[i] - targets[i] into the directory path.
+    @param terms: utf-8 encoded terms in sorted order; sources and targets are positions in terms.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in terms], out=offsets[1:])
+    np.save(os.path.join(path, "terms.offsets.npy"), offsets)
+    np.save(os.path.join(path, "terms.npy"), np.frombuffer("".join(terms), dtype=np.uint8))
+
+    # At most half of the slots are used, so the probe sequences stay short.
+    size = 1 << max(1, 2 * len(terms) - 1).bit_length()
+    slots = np.empty(size, dtype=np.int32)
+    slots.fill(-1)
+    for position, term in enumerate(terms):
+        slot = term_hash(term) & (size - 1)
+        while slots[slot] != -1:
+            slot = (slot + 1) & (size - 1)
+        slots[slot] = position
+    np.save(os.path.join(path, "slots.npy"), slots)
+
+    # Both directions of each edge, grouped by the term, the heaviest neighbors first.
+    weights = np.asarray(weights, dtype=np.int64)
+    rows = np.concatenate((sources, targets))
+    columns = np.concatenate((targets, sources))
+    weights = np.concatenate((weights, weights))
+    order = np.lexsort((columns, -weights, rows))
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(terms)), out=indptr[1:])
+    np.save(os.path.join(path, "indptr.npy"), indptr)
+    np.save(os.path.join(path, "neighbors.npy"), columns[order].astype(np.int32))
+    np.save(os.path.join(path, "weights.npy"), weights[order])
+    logger.info("Wrote the related terms index of {0} terms and {1} edges: {2}".format(
+        len(terms), len(sources), path))
+
+
+def write_index(hist, index, path):
+    """Writes the index of the edges of the histogram, see build_index."""
+    u_ids, v_ids, weights = hist.arrays()
+    terms, u_ranks, v_ranks = term_ranks(index, u_ids, v_ids)
+    build_index(path, terms, u_ranks, v_ranks, weights)
+
+
+def convert_edges(filename, path):
+    """Writes the index of a binary edge list written by export.write_edges."""
+    terms, edges = read_edges(filename)
+    terms = [term.encode("utf-8") for term in terms]
+    order = sorted(xrange(len(terms)), key=terms.__getitem__)
+    ranks = np.empty(len(terms), dtype=np.int64)
+    ranks[order] = np.arange(len(terms))
+    build_index(path, [terms[i] for i in order], ranks[edges["source"]], ranks[edges["target"]],
+                edges["weight"])
+
+
+class RelatedTerms(object):
+    def __init__(self, path):
+        """Read-only view of an index written by build_index."""
+        # Plain array views of the memory maps are much faster to slice.
+        load = lambda name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r").view(np.ndarray)
+        self.data = load("terms")
+        self.offsets = load("terms.offsets")
+        self.slots = load("slots")
+        self.indptr = load("indptr")
+        self.neighbor_ids = load("neighbors")
+        self.weights = load("weights")
+        self.mask = len(self.slots) - 1
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __contains__(self, term):
+        return self.position_of(term) != -1
+
+    def term_of(self, position):
+        return self.data[self.offsets[position]:self.offsets[position + 1]].tostring().decode("utf-8")
+
+    def position_of(self, term):
+        """Returns the position of the term, or -1 if it is not in the index."""
+        term = term.encode("utf-8")
+        slot = term_hash(term) & self.mask
+        while True:
+            position = int(self.slots[slot])
+            if position == -1:
+                return -1
+            if self.data[self.offsets[position]:self.offsets[position + 1]].tostring() == term:
+                return position
+            slot = (slot + 1) & self.mask
+
+    def neighbors(self, term, k=10):
+        """Returns the k most related terms of term as [(term, weight), ...], heaviest first.
+        All of them if k is None.
+        """
+        position = self.position_of(term)
+        if position == -1:
+            raise KeyError, "This term ({0}) does not exist in the index.".format(term.encode("utf-8"))
+        start, end = int(self.indptr[position]), int(self.indptr[position + 1])
+        if k is not None:
+            end = min(end, start + k)
+        return [(self.term_of(neighbor), weight) for neighbor, weight in
+                zip(self.neighbor_ids[start:end].tolist(), self.weights[start:end].tolist())]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Builds and queries the related terms index.")
+    commands = parser.add_subparsers(dest="command")
+    build = commands.add_parser("build", help="build an index from a binary edge list (.zedges)")
+    build.add_argument("edges", help="edge list written with process.py --graph-format edges")
+    build.add_argument("index", help="output directory")
+    lookup = commands.add_parser("lookup", help="print the related terms of the given terms")
+    lookup.add_argument("index", help="index directory")
+    lookup.add_argument("terms", nargs="+")
+    lookup.add_argument("-k", type=int, default=10, help="number of related terms")
+    options = parser.parse_args(args)
+
+    if options.command == "build":
+        convert_edges(options.edges, options.index)
+        return
+    related = RelatedTerms(options.index)
+    for term in options.terms:
+        # Queries are lower case in the index, see RecordStore.append.
+        term = term.decode(sys.stdin.encoding or "utf-8").lower()
+        if term not in related:
+            print "{0}: not found".format(term.encode("utf-8"))
+            continue
+        for neighbor, weight in related.neighbors(term, options.k):
+            print "{0}; {1}; {2}".format(weight, term.encode("utf-8"), neighbor.encode("utf-8"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,81 @@
+"""External sorting helpers for the streaming mode of ZarganApp.
+
+Records are buffered in memory until the memory budget is exceeded. The buffer is then
+sorted and spilled to a temporary file (a "run"). When the input is exhausted all of the runs
+are merged back lazily, so that the caller sees one sorted stream of records while only one
+buffer and one block per run are held in memory.
+"""
+import sys
+import heapq
+import tempfile
+import logging
+import cPickle as pickle
+
+logger = logging.getLogger("ZarganApp")
+
+# Number of items pickled together in a spill file. Bigger blocks are faster to write and read
+# but each open run keeps one block in memory during the merge.
+BLOCK_SIZE = 4096
+
+
+def item_size(item):
+    """Approximate memory footprint of a tuple of strings/ints in bytes."""
+    return sys.getsizeof(item) + sum(sys.getsizeof(field) for field in item)
+
+
+class ExternalSorter(object):
+    def __init__(self, memory_budget=256, temp_dir=None):
+        """Sorts an arbitrary number of tuples by spilling sorted runs to temporary files.
+
+        @param memory_budget: maximum size of the in-memory buffer in megabytes.
+        @param temp_dir: directory for the spill files. System default if None.
+        """
+        self.memory_budget = memory_budget * 1024 * 1024
+        self.temp_dir = temp_dir
+        self.buffer = []
+        self.buffer_size = 0
+        self.runs = []
+
+    def add(self, item):
+        self.buffer.append(item)
+        self.buffer_size += item_size(item)
+        if self.buffer_size >= self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        """Sorts the buffer and writes it to a new run file."""
+        if not self.buffer:
+            return
+        self.buffer.sort()
+        run = tempfile.TemporaryFile(dir=self.temp_dir)
+        for i in xrange(0, len(self.buffer), BLOCK_SIZE):
+            pickle.dump(self.buffer[i:i + BLOCK_SIZE], run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self.runs.append(run)
+        logger.debug("Spilled run #{0} with {1} items.".format(len(self.runs), len(self.buffer)))
+        self.buffer = []
+        self.buffer_size = 0
+
+    def __iter__(self):
+        """Yields all of the added items in sorted order. Can be consumed only once."""
+        if not self.runs:
+            # Everything fits in memory, no need to touch the disk.
+            self.buffer.sort()
+            items, self.buffer = self.buffer, []
+            return iter(items)
+        self.spill()
+        return heapq.merge(*[read_run(run) for run in self.runs])
+
+
+def read_run(run):
+    """Yields the items of a spill file one by one and closes (deletes) it at the end."""
+    try:
+        while True:
+            try:
+                block = pickle.load(run)
+            except EOFError:
+                break
+            for item in block:
+                yield item
+    finally:
+        run.close()
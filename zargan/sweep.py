@@ -0,0 +1,89 @@
+"""Parameter sweeps over window_size and prune_threshold in a single pass.
+
+With simple_chain, two adjacent searches of an IP are linked at window w exactly when the gap between
+them is at most w (and their session is not suspicious). The gap and the packed edge key of every
+adjacent pair are computed once; each window then only needs a comparison, a cumulative sum for the
+session sizes and a bincount over the edge keys. Every threshold is a mask on those counts.
+
+complete_chain edges can not be derived from the adjacent gaps, so for it the sessions and the
+histogram are rebuilt for each window, still without reading and grouping the input again.
+"""
+import os
+import logging
+
+import numpy as np
+
+from histogram import PackedHistogram, pack, unpack
+
+logger = logging.getLogger("ZarganApp")
+
+
+def simple_chain_counts(app, dates, query_ids, groups, windows):
+    """Yields (window, keys, weights) for each window with simple_chain."""
+    gaps = np.diff(dates)
+    same_ip = np.ones(len(gaps), dtype=bool)
+    same_ip[groups.bounds[1:-1] - 1] = False
+    u_ids, v_ids = query_ids[:-1], query_ids[1:]
+    different = u_ids != v_ids
+    keys, key_index = np.unique(pack(u_ids, v_ids), return_inverse=True)
+
+    for window in windows:
+        # pair i joins the searches i and i + 1 into the same session.
+        joined = same_ip & (gaps <= window)
+        sessions = np.concatenate(([0], np.cumsum(~joined)))
+        suspicious = np.bincount(sessions) > app.per_sesssion
+        valid = joined & different & ~suspicious[sessions[:-1]]
+        weights = np.bincount(key_index[valid], minlength=len(keys))
+        used = weights > 0
+        yield window, keys[used], weights[used]
+
+
+def complete_chain_counts(app, dates, query_ids, groups, windows):
+    """Yields (window, keys, weights) for each window with complete_chain."""
+    window_size = app.window_size
+    try:
+        for window in windows:
+            app.window_size = window
+            starts, ends = app.find_sessions(dates, groups=groups)
+            app.occurrence_histogram = hist = PackedHistogram()
+            app.complete_chain(query_ids, starts, ends)
+            hist.reduce()
+            yield window, hist.keys, hist.weights
+    finally:
+        app.window_size = window_size
+
+
+def sweep(app, windows, thresholds, write_outputs=False):
+    """Computes the number of nodes and edges for each (window, threshold) combination.
+    app must have read, grouped and checked its input (read_input, generate_hashmap, check_fraud).
+    @param write_outputs: also write the pruned output of each combination, see ZarganApp.write_text.
+    @return: [(window, threshold, nodes, edges), ...]
+    """
+    store = app.records
+    groups = app.hash_map
+    dates = store.secs[groups.rows]
+    query_ids = store.query_ids[groups.rows]
+    counts = complete_chain_counts if app.use_complete_chain else simple_chain_counts
+
+    base = ".".join(app.output_name.rstrip(os.sep).split(".")[:-1])
+    summary = []
+    for window, keys, weights in counts(app, dates, query_ids, groups, sorted(windows)):
+        for threshold in sorted(thresholds):
+            kept = weights >= threshold
+            u_ids, v_ids = unpack(keys[kept])
+            nodes = len(np.unique(np.concatenate((u_ids, v_ids))))
+            summary.append((window, threshold, nodes, int(kept.sum())))
+            logger.info("window: {0:g}, threshold: {1}, nodes: {2}, edges: {3}".format(*summary[-1]))
+            if write_outputs:
+                app.occurrence_histogram = hist = PackedHistogram()
+                hist.keys, hist.weights = keys[kept], weights[kept]
+                app.write_text("{0}-w{1:g}-t{2}-output.csv".format(base, window, threshold))
+    return summary
+
+
+def write_summary(summary, filename):
+    o = open(filename, "w")
+    o.write("window; threshold; nodes; edges\n")
+    o.write("\n".join("{0:g}; {1}; {2}; {3}".format(*row) for row in summary))
+    o.close()
+    logger.info("Wrote the sweep summary: {0}".format(filename))
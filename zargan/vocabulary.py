@@ -0,0 +1,190 @@
+"""Compact vocabulary of the query terms and the IP addresses.
+
+All of the terms are kept utf-8 encoded in one byte buffer; the term with the id i (ids start at 1)
+is data[offsets[i - 1]:offsets[i]]. Terms are found with an open addressing hash table of the ids
+(crc32, linear probing, 0 if empty) which is at most half full, and the crc32 of each term is kept
+for rehashing and to compare before the bytes. There are no Python objects per term, and lookups
+work on batches of terms with numpy.
+
+A vocabulary can be saved as .npy files and loaded memory mapped, so the ids of the terms stay the
+same across runs and processes:
+
+    {name}.npy, {name}.offsets.npy: the term buffer and the offsets
+    {name}.hashes.npy, {name}.slots.npy: the crc32 of the terms and the hash table
+
+Files without the hashes and the hash table (converted with an older convert.py) are hashed when
+they are loaded. A loaded vocabulary is copied into memory when a new term is added.
+"""
+import os
+import zlib
+import itertools
+
+import numpy as np
+
+# Initial number of terms a vocabulary has room for.
+INITIAL_SIZE = 1024
+
+
+def term_hash(term):
+    """Hash of a utf-8 encoded term."""
+    return zlib.crc32(term) & 0xffffffff
+
+
+def grown(array, size):
+    """Writable copy of the array with room for at least size items, doubling the capacity."""
+    result = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    result[:len(array)] = array
+    return result
+
+
+def place(slots, hashes, ids):
+    """Inserts the ids with the given hashes into the hash table with linear probing."""
+    mask = len(slots) - 1
+    positions = hashes.astype(np.int64) & mask
+    ids = np.asarray(ids)
+    while len(ids):
+        free = np.flatnonzero(slots[positions] == 0)
+        # One of the ids probing the same free slot takes it, the others probe the next slot.
+        taken = free[np.unique(positions[free], return_index=True)[1]]
+        slots[positions[taken]] = ids[taken]
+        left = np.ones(len(ids), dtype=bool)
+        left[taken] = False
+        ids, positions = ids[left], (positions[left] + 1) & mask
+
+
+class Vocabulary(object):
+    def __init__(self, data=None, offsets=None, hashes=None, slots=None):
+        """Empty vocabulary, or the one of the given arrays, see the module documentation.
+        The hashes and the hash table are computed if they are not given.
+        """
+        if data is None:
+            data = np.zeros(8 * INITIAL_SIZE, dtype=np.uint8)
+            offsets = np.zeros(INITIAL_SIZE + 1, dtype=np.int64)
+            hashes = np.zeros(INITIAL_SIZE, dtype=np.uint32)
+            self.count = 0
+        else:
+            self.count = len(offsets) - 1
+        self.data = data
+        self.offsets = offsets
+        if hashes is None:
+            hashes = np.array([term_hash(term) for term in self.encoded_terms(np.arange(1, self.count + 1))],
+                              dtype=np.uint32)
+        self.hashes = hashes
+        if slots is None:
+            slots = np.zeros(max(2 * INITIAL_SIZE, 1 << (2 * self.count).bit_length()), dtype=np.int32)
+            place(slots, self.hashes[:self.count], np.arange(1, self.count + 1))
+        self.slots = slots
+
+    def __len__(self):
+        return self.count
+
+    def reserve(self, count, length):
+        """Makes room for count more terms with length bytes. Copies the memory mapped arrays."""
+        used = int(self.offsets[self.count])
+        if used + length > len(self.data) or not self.data.flags.writeable:
+            self.data = grown(self.data[:used], used + length)
+        if self.count + count >= len(self.offsets) or not self.offsets.flags.writeable:
+            self.offsets = grown(self.offsets[:self.count + 1], self.count + count + 1)
+            self.hashes = grown(self.hashes[:self.count], self.count + count)
+        size = len(self.slots)
+        while 2 * (self.count + count) > size:
+            size *= 2
+        if size > len(self.slots):
+            self.slots = np.zeros(size, dtype=np.int32)
+            place(self.slots, self.hashes[:self.count], np.arange(1, self.count + 1))
+        elif not self.slots.flags.writeable:
+            self.slots = np.array(self.slots)
+
+    def find(self, terms, hashes):
+        """Returns the ids of the utf-8 encoded terms as an array, 0 for the missing ones."""
+        ids = np.zeros(len(terms), dtype=np.int64)
+        mask = len(self.slots) - 1
+        pending = np.arange(len(terms))
+        positions = hashes.astype(np.int64) & mask
+        while len(pending):
+            candidates = self.slots[positions].astype(np.int64)
+            occupied = candidates != 0
+            same = np.zeros(len(pending), dtype=bool)
+            same[occupied] = self.hashes[candidates[occupied] - 1] == hashes[pending[occupied]]
+            for i in np.flatnonzero(same).tolist():
+                candidate = int(candidates[i])
+                term = self.data[self.offsets[candidate - 1]:self.offsets[candidate]].tostring()
+                if term == terms[pending[i]]:
+                    ids[pending[i]] = candidate
+                    occupied[i] = False
+            pending, positions = pending[occupied], (positions[occupied] + 1) & mask
+        return ids
+
+    def get_indexes_of(self, values):
+        """Returns the ids of the terms as an array. New terms are added in the order they first appear.
+        @param values: sequence of unicode terms.
+        """
+        unique = {}
+        positions = np.fromiter((unique.setdefault(value, len(unique)) for value in values), dtype=np.int64)
+        terms = [None] * len(unique)
+        for value, position in unique.iteritems():
+            terms[position] = value.encode("utf-8")
+        hashes = np.fromiter((term_hash(term) for term in terms), dtype=np.uint32, count=len(terms))
+        ids = self.find(terms, hashes)
+
+        new = np.flatnonzero(ids == 0)
+        if len(new):
+            new_terms = [terms[i] for i in new.tolist()]
+            joined = "".join(new_terms)
+            self.reserve(len(new), len(joined))
+            used = int(self.offsets[self.count])
+            if joined:
+                self.data[used:used + len(joined)] = np.frombuffer(joined, dtype=np.uint8)
+            ids[new] = np.arange(self.count + 1, self.count + len(new) + 1)
+            self.offsets[self.count + 1:self.count + len(new) + 1] = used + np.cumsum(map(len, new_terms))
+            self.hashes[self.count:self.count + len(new)] = hashes[new]
+            self.count += len(new)
+            place(self.slots, hashes[new], ids[new])
+        return ids[positions]
+
+    def get_index_of(self, value):
+        return int(self.get_indexes_of([value])[0])
+
+    def get_value_of(self, key):
+        if not 0 < key <= self.count:
+            raise KeyError, "This key ({0}) does not exist in the index.".format(key)
+        return self.data[self.offsets[key - 1]:self.offsets[key]].tostring().decode("utf-8")
+
+    def encoded_terms(self, ids):
+        """Returns the utf-8 encoded terms of the ids, without decoding them."""
+        ids = np.asarray(ids, dtype=np.int64)
+        data = self.data[:int(self.offsets[self.count])].tostring()
+        return [data[start:end] for start, end in
+                itertools.izip(self.offsets[ids - 1].tolist(), self.offsets[ids].tolist())]
+
+    def terms_of(self, ids):
+        """Returns the terms of the ids."""
+        return [term.decode("utf-8") for term in self.encoded_terms(ids)]
+
+    def save(self, path, name):
+        """Writes the vocabulary into the directory path, see the module documentation."""
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for suffix, array in (("", self.data[:int(self.offsets[self.count])]),
+                              (".offsets", self.offsets[:self.count + 1]),
+                              (".hashes", self.hashes[:self.count]),
+                              (".slots", self.slots)):
+            # The arrays may be memory maps of the files themselves, so they are not overwritten in place.
+            filename = os.path.join(path, name + suffix + ".npy")
+            np.save(filename + ".tmp.npy", array)
+            os.rename(filename + ".tmp.npy", filename)
+
+    @classmethod
+    def exists(cls, path, name):
+        return os.path.exists(os.path.join(path, name + ".offsets.npy"))
+
+    @classmethod
+    def load(cls, path, name):
+        """Memory maps a vocabulary written by save."""
+        def load(suffix):
+            filename = os.path.join(path, name + suffix + ".npy")
+            if not os.path.exists(filename):
+                return None
+            # Plain array views of the memory maps are much faster to slice.
+            return np.load(filename, mmap_mode="r").view(np.ndarray)
+        return cls(load(""), load(".offsets"), load(".hashes"), load(".slots"))
@@ -0,0 +1,184 @@
+"""Long-lived worker process of the GUI.
+
+The worker keeps the parsed input, the IP groups and the unpruned histogram of the last run in
+memory, so a new run only repeats the stages its changed parameters invalidate: a new threshold only
+prunes and writes the edges again, a new window size also rebuilds the histogram, and only a new file
+or line count reads the input again.
+
+The GUI puts the ZarganApp parameters of each run into the requests queue and reads (kind, value)
+messages from the progress queue:
+
+    ("stage", name)         a stage has started
+    ("done", report)        the run has finished; report is the one of Metrics.report
+    ("cancelled", name)     the run stopped before the stage name after the cancel event was set
+    ("error", message)      a stage raised an exception; the cached data is dropped
+
+Cancellation is cooperative: the cancel event is checked between the stages, and the stages which
+have finished stay valid for the next run. The GUI clears the event when it puts a request, so a
+Stop before the worker picks the request up cancels it. None in the requests queue stops the worker.
+"""
+import logging
+import traceback
+
+from histogram import HISTOGRAMS
+from process import ZarganApp
+
+logger = logging.getLogger("ZarganApp")
+
+STAGES = ("read_input", "generate_hashmap", "check_fraud", "write_hashmap", "generate_histogram",
+          "prune_histogram", "write_text", "export_graph")
+
+# The first stage to repeat when a parameter changes; None if it does not change the outputs.
+# Parameters which are not listed invalidate everything.
+INVALIDATES = {
+    "filename": "read_input",
+    "item_count": "read_input",
+    "per_ip": "check_fraud",
+    "window_size": "generate_histogram",
+    "per_session": "generate_histogram",
+    "complete_chain": "generate_histogram",
+    "histogram": "generate_histogram",
+    "heavy_memory": "generate_histogram",
+    "heavy_exact": "generate_histogram",
+    "prune_threshold": "prune_histogram",
+    "top": "write_text",
+    "top_per_term": "write_text",
+    "graph_format": "export_graph",
+    "generate_graph": "export_graph",
+    "workers": None,
+    "metrics_file": None,
+}
+
+# Histograms which are built again for a new threshold instead of pruning a copy: the heavy histogram
+# only keeps the edges that may reach the threshold, the spill histogram drops the lighter edges while
+# it is reduced, and the order of the edges of the dict histogram (and so of the graph file) depends on
+# the history of the dict.
+REBUILT_FOR_THRESHOLD = ("dict", "heavy", "spill")
+
+
+class Cancelled(Exception):
+    pass
+
+
+def first_stage(old, new):
+    """Returns the position in STAGES of the first stage to run for the parameters new.
+    @param old: parameters of the cached data, or None if there is nothing cached.
+    """
+    if old is None:
+        return 0
+    first = len(STAGES)
+    for name in set(old) | set(new):
+        if old.get(name) == new.get(name):
+            continue
+        stage = INVALIDATES.get(name, "read_input")
+        if name == "prune_threshold" and new.get("histogram", "packed") in REBUILT_FOR_THRESHOLD:
+            stage = "generate_histogram"
+        if stage is not None:
+            first = min(first, STAGES.index(stage))
+    return first
+
+
+class PipelineWorker(object):
+    def __init__(self, progress, cancel):
+        """Runs the requests of the GUI, see the module documentation.
+        @param progress: queue the progress messages are put into.
+        @param cancel: multiprocessing.Event which cancels the current run.
+        """
+        self.progress = progress
+        self.cancel = cancel
+        self.reset()
+
+    def reset(self):
+        """Drops the cached data."""
+        self.params = None
+        self.app = None
+        # Number of the stages in STAGES which are valid for params.
+        self.valid = 0
+        # IP groups before check_fraud and the histogram before prune_histogram.
+        self.groups = None
+        self.histogram = None
+
+    def handle(self, params):
+        """Runs a request and reports its outcome."""
+        try:
+            report = self.run(params)
+        except Cancelled, e:
+            logger.info("The computation was cancelled before {0}.".format(e))
+            self.progress.put(("cancelled", str(e)))
+        except Exception:
+            logger.exception("The computation has failed.")
+            self.reset()
+            self.progress.put(("error", traceback.format_exc()))
+        else:
+            self.progress.put(("done", report))
+
+    def run(self, params):
+        """Runs the stages of ZarganApp.run which are not valid for params.
+        @return: metrics report of the stages which were run.
+        """
+        first = min(self.valid, first_stage(self.params, params))
+        logger.info("Running from {0}...".format(STAGES[first] if first < len(STAGES) else "the end"))
+        app = ZarganApp(**params)
+        # The data of the valid stages.
+        for name in ("records", "index", "hash_map", "occurrence_histogram"):
+            if hasattr(self.app, name):
+                setattr(app, name, getattr(self.app, name))
+        self.app, self.params, self.valid = app, params, first
+
+        for position in xrange(first, len(STAGES)):
+            name = STAGES[position]
+            if self.cancel.is_set():
+                raise Cancelled(name)
+            if name != "export_graph" or app.graph_choice == "y":
+                self.progress.put(("stage", name))
+                with app.metrics.stage(name) as stage:
+                    getattr(self, name)(app, stage)
+            self.valid = position + 1
+
+        if app.metrics_file:
+            app.metrics.write(app.metrics_file)
+        logger.info("Computation has finished... See the outputs.")
+        return app.metrics.report()
+
+    def read_input(self, app, stage):
+        app.read_input()
+        stage["records"] = len(app.records)
+
+    def generate_hashmap(self, app, stage):
+        app.generate_hashmap()
+        self.groups = app.hash_map
+        stage["ips"] = len(self.groups)
+
+    def check_fraud(self, app, stage):
+        app.hash_map = self.groups
+        app.check_fraud()
+
+    def write_hashmap(self, app, stage):
+        app.write_hashmap()
+
+    def generate_histogram(self, app, stage):
+        app.generate_histogram()
+        self.histogram = app.occurrence_histogram
+        stage["records"] = len(app.hash_map.rows)
+        stage["ips"] = len(app.hash_map)
+
+    def prune_histogram(self, app, stage):
+        # Pruning is in place, so a copy of the cached histogram is pruned, see REBUILT_FOR_THRESHOLD.
+        if app.histogram in REBUILT_FOR_THRESHOLD:
+            app.occurrence_histogram = self.histogram
+        else:
+            app.occurrence_histogram = HISTOGRAMS[app.histogram].from_arrays(*self.histogram.arrays())
+        app.prune_histogram()
+
+    def write_text(self, app, stage):
+        app.write_text()
+
+    def export_graph(self, app, stage):
+        app.export_graph()
+
+
+def serve(requests, progress, cancel):
+    """Target of the worker process. Runs the parameters from the requests queue until None."""
+    worker = PipelineWorker(progress, cancel)
+    for params in iter(requests.get, None):
+        worker.handle(params)